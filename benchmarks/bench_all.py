@@ -0,0 +1,81 @@
+"""Wall-clock and peak Python memory of `camtrap_dp.py all`, with every
+builder reading its own inputs vs one shared SurveyContext.
+
+    python benchmarks/bench_all.py -p <survey folder> -v 1.0-rc.1
+
+Outputs are written to a temporary directory. Schemas are loaded
+through the schema cache, so prefetch them first.
+"""
+import os
+import sys
+import time
+import argparse
+import warnings
+import tempfile
+import tracemalloc
+from pathlib import Path
+from contextlib import redirect_stdout
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import schema_cache
+from camtrap_dp import SurveyContext, create_deployments, create_media, create_observations
+
+
+def separate(path, version):
+    create_deployments(path, version)
+    create_media(path, version)
+    create_observations(path, version)
+
+
+def shared(path, version):
+    context = SurveyContext(path, version)
+    create_deployments(path, version, context)
+    create_media(path, version, context)
+    create_observations(path, version, context)
+
+
+def measure(func, path, version, trace):
+    schema_cache._loaded.clear()
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        if trace:
+            tracemalloc.start()
+        start = time.perf_counter()
+        func(path, version)
+        seconds = time.perf_counter() - start
+        peak = 0
+        if trace:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    return seconds, peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-p", "--path", type=str, required=True)
+    parser.add_argument("-v", "--version", type=str, required=True)
+    parser.add_argument("-r", "--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    warnings.simplefilter("ignore")
+    path = str(Path(args.path).resolve())
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        os.makedirs('output/dp')
+        # interleave the two variants so drift affects both alike
+        timings = {separate: [], shared: []}
+        for _ in range(args.repeat):
+            for func in timings:
+                timings[func].append(measure(func, path, args.version, False)[0])
+        results = {}
+        for func in timings:
+            results[func.__name__] = (min(timings[func]), measure(func, path, args.version, True)[1])
+
+    for name, (seconds, peak) in results.items():
+        print(f"{name:>9}: {seconds:8.3f} s  peak {peak / 2**20:8.1f} MiB")
+    (sep_s, sep_peak), (sh_s, sh_peak) = results['separate'], results['shared']
+    print(f"   saving: {sep_s - sh_s:8.3f} s ({(1 - sh_s / sep_s) * 100:.0f}%)"
+          f"  peak {(sep_peak - sh_peak) / 2**20:8.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Rows/s of the observation eventStart/eventEnd computation, row-wise vs columnar.
+
+    python benchmarks/bench_event_times.py --sizes 10000 1000000 10000000
+
+Both paths start from the Points table and the Metadata table and include
+the merge between them. The row-wise path is timed on at most
+--legacy-limit rows and its rate is reported for the full size (it is
+linear in the number of rows).
+"""
+import sys
+import time
+import argparse
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from camtrap_dp import parse_deployment_start, offset_minutes
+
+
+def synthetic_survey(size, deployments=1000, seed=0):
+    rng = np.random.default_rng(seed)
+    minutes = rng.integers(0, 60 * 24, deployments)
+    df_metadata = pd.DataFrame({
+        'Sample': np.arange(deployments) / 100 + 1,
+        'Date': 20190800 + rng.integers(1, 29, deployments),
+        'Time': [f"{m // 60:02d}:{m % 60:02d}:00" for m in minutes],
+    })
+    df_points = pd.DataFrame({
+        'OpCode': df_metadata['Sample'].to_numpy()[rng.integers(0, deployments, size)],
+        'Time': rng.random(size) * 60,
+        'PeriodTime': rng.random(size) * 5,
+    })
+    return df_points, df_metadata
+
+
+def fix_date(dt, delta):
+    return pd.to_datetime(dt, format='%Y-%m-%dT%H:%M:%SZ') + pd.Timedelta(minutes=float(delta))
+
+
+def row_wise(df_points, df_metadata):
+    df_points = pd.merge(df_points, df_metadata, left_on='OpCode', right_on='Sample', suffixes=(None, "_dep", ))
+    df_points['dateTime'] = pd.to_datetime(df_points['Date'].astype(str) + df_points['Time_dep'].astype(str),
+                                           format='%Y%m%d%H:%M:%S').apply(lambda x: x.strftime('%Y-%m-%dT%H:%M:%SZ'))
+    event_start = df_points.apply(lambda row: fix_date(row['dateTime'], row['Time']), axis=1)
+    event_end = df_points.apply(lambda row: fix_date(row['dateTime'], row['Time'] + row['PeriodTime']), axis=1)
+    return event_start, event_end
+
+
+def columnar(df_points, df_metadata):
+    df_metadata = df_metadata.assign(deploymentStart=parse_deployment_start(df_metadata['Date'], df_metadata['Time']))
+    df_points = pd.merge(df_points, df_metadata, left_on='OpCode', right_on='Sample', suffixes=(None, "_dep", ))
+    event_start = offset_minutes(df_points['deploymentStart'], df_points['Time'])
+    event_end = offset_minutes(df_points['deploymentStart'], df_points['Time'] + df_points['PeriodTime'])
+    return event_start, event_end
+
+
+def rows_per_second(func, df_points, df_metadata):
+    start = time.perf_counter()
+    func(df_points, df_metadata)
+    return len(df_points) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 1_000_000, 10_000_000])
+    parser.add_argument("--legacy-limit", type=int, default=100_000)
+    args = parser.parse_args()
+
+    check = synthetic_survey(1000)
+    for legacy, current in zip(row_wise(*check), columnar(*check)):
+        assert legacy.equals(current), "columnar event times differ from the row-wise ones"
+
+    print(f"{'rows':>12} {'row-wise rows/s':>18} {'columnar rows/s':>18} {'speedup':>9}")
+    for size in args.sizes:
+        df_points, df_metadata = synthetic_survey(size)
+        legacy = rows_per_second(row_wise, df_points.head(args.legacy_limit), df_metadata)
+        current = rows_per_second(columnar, df_points, df_metadata)
+        marker = "*" if size > args.legacy_limit else " "
+        print(f"{size:>12,} {legacy:>17,.0f}{marker} {current:>18,.0f} {current / legacy:>8.0f}x")
+    print(f"* row-wise rate measured on the first {args.legacy_limit:,} rows")
+
+
+if __name__ == "__main__":
+    main()
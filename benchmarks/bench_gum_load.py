@@ -0,0 +1,70 @@
+"""Rows/s of the GUM load, batched executemany inserts vs COPY in one transaction
+vs COPY of independent tables at the same time.
+
+    docker compose up -d
+    python benchmarks/bench_gum_load.py --deployments 10 --workers 4
+
+Every path loads the same deployments of output/dp into an emptied database
+and the content of every table is compared afterwards. --deployments
+limits the run to the first deployments of the package.
+"""
+import sys
+import time
+import argparse
+from contextlib import redirect_stdout
+from io import StringIO
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import database
+import camtrap_gum
+
+
+def first_deployments(package, count):
+    deployment_ids = [str(row['deploymentID']) for row in camtrap_gum.read_rows(package, 'deployments')]
+    return set(deployment_ids[:count]) if count else None
+
+
+def table_contents():
+    contents = {}
+    with database.engine.connect() as connection:
+        for table in database.Base.metadata.sorted_tables:
+            contents[table.name] = sorted(map(tuple, connection.execute(table.select())), key=repr)
+    return contents
+
+
+def timed_load(package, deployments, bulk, workers=1):
+    database.truncate_db()
+    start = time.perf_counter()
+    with redirect_stdout(StringIO()):
+        camtrap_gum.load(package, deployments, bulk, workers)
+    return time.perf_counter() - start, table_contents()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--package", default="output/dp")
+    parser.add_argument("--deployments", type=int, default=10, help="0 loads every deployment")
+    parser.add_argument("--workers", type=int, default=4, help="tables loaded at the same time by the scheduled COPY")
+    args = parser.parse_args()
+
+    package = camtrap_gum.open_package(args.package)
+    deployments = first_deployments(package, args.deployments)
+
+    orm_seconds, orm = timed_load(package, deployments, bulk=False)
+    bulk_seconds, bulk = timed_load(package, deployments, bulk=True)
+    assert orm == bulk, "COPY load differs from the batched insert load"
+    scheduled_seconds, scheduled = timed_load(package, deployments, bulk=True, workers=args.workers)
+    assert scheduled == bulk, "scheduled COPY load differs from the single transaction one"
+
+    rows = sum(len(table_rows) for table_rows in bulk.values())
+    print(f"{rows:,} rows in {sum(1 for table_rows in bulk.values() if table_rows)} tables")
+    print(f"{'path':>8} {'seconds':>9} {'rows/s':>10}")
+    print(f"{'insert':>8} {orm_seconds:>9.2f} {rows / orm_seconds:>10,.0f}")
+    print(f"{'copy':>8} {bulk_seconds:>9.2f} {rows / bulk_seconds:>10,.0f}")
+    print(f"{f'copy -w{args.workers}':>8} {scheduled_seconds:>9.2f} {rows / scheduled_seconds:>10,.0f}")
+    print(f"speedup {orm_seconds / bulk_seconds:.0f}x, {orm_seconds / scheduled_seconds:.0f}x with {args.workers} workers")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""Rows/s of the GUM row builders per mapping, models.* instance vs column
+dict vs the value tuples the loaders use.
+
+    python benchmarks/bench_gum_mapping.py --package output/dp --repeat 3
+
+The rows of every resource are decoded once beforehand, only the building
+is timed. The instance path is the one of the add_* functions of
+camtrap_gum.py, a mapped object per row.
+"""
+import sys
+import time
+import argparse
+import warnings
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import camtrap_gum
+import gum_mapping
+
+
+def resource_rows(package):
+    rows = {}
+    for resource_name in camtrap_gum.GUM_RESOURCES:
+        rows[resource_name] = list(camtrap_gum.read_rows(package, resource_name))
+    return rows
+
+
+def rate(build, rows, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for row in rows:
+            build(row, location_id='location')
+        best = min(best, time.perf_counter() - start)
+    return len(rows) / best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--package", default="output/dp")
+    parser.add_argument("--repeat", type=int, default=3, help="best of this many runs")
+    args = parser.parse_args()
+
+    warnings.simplefilter('ignore')
+    rows = resource_rows(camtrap_gum.open_package(args.package))
+    mappings = dict(gum_mapping.RESOURCE_MAPPINGS)
+    mappings['media-observations'] = mappings['media-observations'] + ['taxon', 'taxon_identification']
+    print(f"{'mapping':>20} {'tables':>32} {'instance/s':>11} {'dict/s':>11} {'tuple/s':>11} {'speedup':>8}")
+    for resource_name, names in mappings.items():
+        for name in names:
+            mapping = gum_mapping.MAPPINGS[name]
+            tables = ', '.join(table.name for table in mapping.tables)
+            instances = rate(mapping.instance, rows[resource_name], args.repeat)
+            values = rate(mapping.values, rows[resource_name], args.repeat)
+            tuples = rate(mapping.rows, rows[resource_name], args.repeat)
+            print(f"{name:>20} {tables:>32} {instances:>11,.0f} {values:>11,.0f} {tuples:>11,.0f} "
+                  f"{tuples / instances:>7.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,45 +1,56 @@
-from frictionless import Resource, Dialect, describe, Package, validate
+from frictionless import Resource, Dialect, describe, Package
 import pandas as pd
+import numpy as np
 import argparse
 from datetime import datetime, timedelta
+from functools import cached_property, partial
 from pprint import pprint
 from pathlib import Path
-from urllib.request import urlopen
+import sys
 import json
-import math
+import time
+import shutil
+import traceback
+from contextlib import redirect_stdout
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import manifest
+import schema_cache
+import validation
 
 
-def find_resource(folder_path, resource_type):
-    resource_path = None
-    file_name_mapping = {
-        "metadata": "2019-08-29_Ningaloo.Marine.Park.Commonwealth_stereo-BRUVs_Metadata.csv",
-        "movieseq": "2019-08-29_Ningaloo.Marine.Park.Commonwealth_stereo-BRUVs_MovieSeq.txt",
-        "lengths": "2019-08-29_Ningaloo.Marine.Park.Commonwealth_stereo-BRUVs_Lengths.txt",
-        "points": "2019-08-29_Ningaloo.Marine.Park.Commonwealth_stereo-BRUVs_Points.txt"
-    }
+DEFAULT_SURVEY = "2019-08-29_Ningaloo.Marine.Park.Commonwealth_stereo-BRUVs"
+
+RESOURCE_SUFFIXES = {
+    "metadata": "_Metadata.csv",
+    "movieseq": "_MovieSeq.txt",
+    "lengths": "_Lengths.txt",
+    "points": "_Points.txt"
+}
+
 
-    if resource_type in file_name_mapping:
-        resource_path = Path(folder_path) / file_name_mapping[resource_type]
+def find_resource(folder_path, resource_type, survey=DEFAULT_SURVEY):
+    resource_path = None
+    if resource_type in RESOURCE_SUFFIXES:
+        resource_path = Path(folder_path) / f"{survey}{RESOURCE_SUFFIXES[resource_type]}"
 
     return resource_path
 
 
-def read_schema(schema_name, version):
-    schema_urls = {
-        "deployments": f"https://raw.githubusercontent.com/tdwg/camtrap-dp/{version}/deployments-table-schema.json",
-        "media": f"https://raw.githubusercontent.com/tdwg/camtrap-dp/{version}/media-table-schema.json",
-        "observations": f"https://raw.githubusercontent.com/tdwg/camtrap-dp/{version}/observations-table-schema.json",
-        "event-observations": f"https://raw.githubusercontent.com/tdwg/camtrap-dp/{version}/event-observations-table-schema.json"
-    }
+def discover_surveys(root):
+    # every *_Metadata.csv with MovieSeq and Points exports next to it is a survey
+    surveys = []
+    suffix = RESOURCE_SUFFIXES['metadata']
+    for metadata_path in sorted(Path(root).rglob(f"*{suffix}")):
+        folder, survey = metadata_path.parent, metadata_path.name[:-len(suffix)]
+        if all(find_resource(folder, resource_type, survey).exists() for resource_type in ('movieseq', 'points')):
+            surveys.append((str(folder), survey))
+        else:
+            print(f"Skipping {metadata_path}: MovieSeq or Points export not found")
+    return surveys
 
-    schema_url = schema_urls.get(schema_name)
-    print(schema_url)
-    if schema_url:
-        with urlopen(schema_url) as response:
-            data_json = json.loads(response.read().decode())
-            return data_json
-    else:
-        return None
+
+def read_schema(schema_name, version):
+    return schema_cache.load_schema(schema_name, version)
 
 
 def read_schema_field_names(schema_name, version):
@@ -50,39 +61,173 @@ def read_schema_field_names(schema_name, version):
         field_names.append(fields['name'])
     print(field_names)
     return field_names
-    
-def create_deployments(path, version):
-    cols = read_schema_field_names('deployments', version)
-    filepath = find_resource(path, 'metadata')
-    with Resource(filepath) as metadata:
-        # pprint(metadata.read_rows())
-        print(metadata.schema)
-
-        df_metadata = metadata.to_pandas()
-        df_deployments = pd.DataFrame(columns=cols)
-        df_deployments['deploymentID'] = df_metadata['Sample'].astype(str)
-        df_deployments['locationID'] = df_metadata['Site']
-        df_deployments['locationName'] = df_metadata['Location']
-        df_deployments['latitude'] = df_metadata['Latitude']
-        df_deployments['longitude'] = df_metadata['Longitude']
-        df_deployments['coordinateUncertainty'] = 50
-        df_deployments['cameraModel'] = 'Canon Legria HFG25'
-        df_deployments['baitUse'] = 'true'
-        df_deployments['habitat'] = 'Cover of benthos and score of complexity'
-        df_deployments['deploymentStart'] = pd.to_datetime(
-            df_metadata['Date'].astype(str)+ df_metadata['Time'].astype(str), 
-            format='%Y%m%d%H:%M:%S').apply(lambda x: x.strftime('%Y-%m-%dT%H:%M:%SZ'))
-        df_deployments['deploymentEnd'] = pd.to_datetime(
-            df_metadata['Date'].astype(str)+ df_metadata['Time'].astype(str), 
-            format='%Y%m%d%H:%M:%S').apply(lambda x: x.strftime('%Y-%m-%dT%H:%M:%SZ'))
-
-        deployments = Resource(df_deployments)
-        target = deployments.write('output/dp/deployments.csv')
+
+
+PARQUET_COMPRESSION = 'zstd'
+
+RESOURCE_FORMATS = {
+    "csv": {"format": "csv", "mediatype": "text/csv"},
+    "parquet": {"format": "parquet", "mediatype": "application/vnd.apache.parquet"}
+}
+
+
+def arrow_type(field_type):
+    import pyarrow as pa
+
+    return {
+        "integer": pa.int64(),
+        "number": pa.float64(),
+        "boolean": pa.bool_(),
+        "datetime": pa.timestamp('s', tz='UTC'),
+        "date": pa.date32(),
+    }.get(field_type, pa.string())
+
+
+def arrow_schema(fields):
+    import pyarrow as pa
+
+    return pa.schema([pa.field(field['name'], arrow_type(field.get('type'))) for field in fields])
+
+
+def to_arrow_column(column, field_type):
+    import pyarrow as pa
+
+    # empty cells are nulls whatever the type
+    column = column.astype(object).where(column.notna() & (column.astype(object) != ''), None)
+    if field_type == 'integer':
+        column = pd.to_numeric(column).astype('Int64')
+    elif field_type == 'number':
+        column = pd.to_numeric(column).astype(float)
+    elif field_type == 'boolean':
+        column = column.map(lambda value: value if value is None or isinstance(value, bool) else str(value).lower() == 'true')
+    elif field_type in ('datetime', 'date'):
+        column = pd.to_datetime(column, utc=True).dt.floor('s')
+        if field_type == 'date':
+            column = column.dt.date
+    else:
+        column = column.astype('string')
+    return pa.array(column, type=arrow_type(field_type), from_pandas=True)
+
+
+def to_arrow_table(df, fields):
+    """Builds a pyarrow table typed by the Camtrap DP schema fields."""
+    import pyarrow as pa
+
+    arrays = [
+        to_arrow_column(df[field['name']] if field['name'] in df else pd.Series([None] * len(df), dtype=object),
+                        field.get('type'))
+        for field in fields
+    ]
+    return pa.Table.from_arrays(arrays, schema=arrow_schema(fields))
+
+
+def write_parquet(df, target_path, fields):
+    import pyarrow.parquet as pq
+
+    pq.write_table(to_arrow_table(df, fields), target_path, compression=PARQUET_COMPRESSION)
+
+
+def set_package_resource_format(output_dir, name, output_format):
+    # points the datapackage.json resource, if any, at the file just written
+    package_path = Path(output_dir) / 'datapackage.json'
+    if not package_path.exists():
+        return
+    with open(package_path) as json_file:
+        data_json = json.load(json_file)
+    for resource in data_json.get('resources', []):
+        if resource.get('name') == name:
+            path = f"{name}.{output_format}"
+            if resource.get('path') != path:
+                resource.update(path=path, **RESOURCE_FORMATS[output_format])
+                with open(package_path, 'w') as fp:
+                    json.dump(data_json, fp, indent=4)
+
+
+class SurveyContext:
+    """Inputs of one survey, each read and parsed at most once and shared
+    by the create_* builders.
+
+    Args:
+        path (str): folder holding the EventMeasure exports
+        version (str): Camtrap DP version of the schemas
+        survey (str): file name prefix of the survey exports
+        output_dir (str): folder the Camtrap DP resources are written to
+        output_format (str): csv or parquet
+    """
+
+    def __init__(self, path, version, survey=DEFAULT_SURVEY, output_dir='output/dp', output_format='csv'):
+        self.path = path
+        self.version = version
+        self.survey = survey
+        self.output_dir = output_dir
+        self.output_format = output_format
+        self._field_names = {}
+
+    def find_resource(self, resource_type):
+        return find_resource(self.path, resource_type, self.survey)
+
+    def output_path(self, name):
+        return str(Path(self.output_dir) / f"{name}.{self.output_format}")
+
+    def write(self, df, name):
+        if self.output_format == 'parquet':
+            write_parquet(df, self.output_path(name), read_schema(name, self.version)['fields'])
+            set_package_resource_format(self.output_dir, name, self.output_format)
+            print(f"{name}: {len(df)} rows written to {self.output_path(name)}")
+            return
+
+        target = Resource(df).write(self.output_path(name))
+        set_package_resource_format(self.output_dir, name, self.output_format)
 
         # Print resulting schema and data
         print(target.schema)
         print(target.to_view())
 
+    def field_names(self, schema_name):
+        if schema_name not in self._field_names:
+            self._field_names[schema_name] = read_schema_field_names(schema_name, self.version)
+        return self._field_names[schema_name]
+
+    @cached_property
+    def metadata(self):
+        df_metadata = Resource(self.find_resource('metadata')).to_pandas()
+        df_metadata['deploymentStart'] = parse_deployment_start(df_metadata['Date'], df_metadata['Time'])
+        return df_metadata
+
+    @cached_property
+    def deployment_start(self):
+        # Sample -> deploymentStart as written in deployments.csv
+        return dict(zip(self.metadata.Sample, format_timestamp(self.metadata['deploymentStart'])))
+
+    @cached_property
+    def movieseq(self):
+        return pd.read_table(self.find_resource('movieseq'))
+
+    @cached_property
+    def points(self):
+        return pd.read_table(self.find_resource('points'))
+
+    
+def create_deployments(path, version, context=None):
+    context = context or SurveyContext(path, version)
+    cols = context.field_names('deployments')
+    df_metadata = context.metadata
+    df_deployments = pd.DataFrame(columns=cols)
+    df_deployments['deploymentID'] = df_metadata['Sample'].astype(str)
+    df_deployments['locationID'] = df_metadata['Site']
+    df_deployments['locationName'] = df_metadata['Location']
+    df_deployments['latitude'] = df_metadata['Latitude']
+    df_deployments['longitude'] = df_metadata['Longitude']
+    df_deployments['coordinateUncertainty'] = 50
+    df_deployments['cameraModel'] = 'Canon Legria HFG25'
+    df_deployments['baitUse'] = 'true'
+    df_deployments['habitat'] = 'Cover of benthos and score of complexity'
+    deployment_start = format_timestamp(df_metadata['deploymentStart'])
+    df_deployments['deploymentStart'] = deployment_start
+    df_deployments['deploymentEnd'] = deployment_start
+
+    context.write(df_deployments, 'deployments')
+
 
 
 # mediaID	deploymentID	eventID	captureMethod	timestamp	filePath	filePublic	fileName	fileMediatype	exifData	favorite	mediaComments
@@ -96,55 +241,45 @@ def create_deployments(path, version):
 # 1.03	    1	    0	            0.00000	        0	    1.03_R368.avi	128255	25.00000
 # 1.04	    0	    0	            0.00000	        0	    1.04_L375.avi	133066	25.00000
 
-def create_media(path, version):
-    cols = read_schema_field_names('media', version)
+def create_media(path, version, context=None):
+    context = context or SurveyContext(path, version)
+    cols = context.field_names('media')
     print(cols)
     
-    df_metadata = Resource(find_resource(path, 'metadata')).to_pandas()
-    time_dict = dict(zip(df_metadata.Sample, pd.to_datetime(
-        df_metadata['Date'].astype(str)+ df_metadata['Time'].astype(str), 
-        format='%Y%m%d%H:%M:%S').apply(lambda x: x.strftime('%Y-%m-%dT%H:%M:%SZ'))))
+    time_dict = context.deployment_start
+    df_movieseq = context.movieseq
+    print(df_movieseq.columns)
+    # sample_id = df_movieseq['Filename'].map(lambda x: str(x)[:-9]).drop_duplicates(keep='last')
+    # print("xxx============================")
+    # print(sample_id)
+    # row = df_metadata.loc[df_metadata['Sample'] == sample_id]
+    # row = df_metadata[df_metadata.Sample == sample_id]
+    # print(row)
     
-    filepath = find_resource(path, 'movieseq')
-    with open(filepath) as movieseq:
-        df_movieseq = pd.read_table(movieseq)
-        print(df_movieseq.columns)
-        # sample_id = df_movieseq['Filename'].map(lambda x: str(x)[:-9]).drop_duplicates(keep='last')
-        # print("xxx============================")
-        # print(sample_id)
-        # row = df_metadata.loc[df_metadata['Sample'] == sample_id]
-        # row = df_metadata[df_metadata.Sample == sample_id]
-        # print(row)
-        
-        # df = pd.DataFrame({'col2': {0: 'a', 1: 1, 2: 2, 3: 3}, 'col1': {0: 'w', 1: 1.01, 2: 2.02, 3: 2.02}})
-        # di = {1: "A", 2: "B"}
-        # print(df)
-        # # df.replace({"col1": di})
-        # df["col1"].replace(time_dict, inplace=True)
-        # print(df)
-
-        df_media = pd.DataFrame(columns=cols)
-        df_media['mediaID'] = df_movieseq['Filename'].map(lambda x: str(x)[:-4]).astype(str)
-        df_media['deploymentID'] = df_movieseq['OpCode'].astype(str)
-        df_media['captureMethod'] = 'motionDetection'
-        df_media['timestamp'] = df_movieseq['Filename'].map(lambda x: str(x)[:-9]).astype('float')
-        df_media['filePath'] = 'https://data.csiro.au/collection/'
-        df_media['filePublic'] = True
-        df_media['fileName'] = df_movieseq['Filename']
-        df_media['fileMediatype'] = 'video/x-msvideo'
-        df_media['exifData'] = ''
-        df_media['favorite'] = ''
-        df_media['mediaComments'] = ''
-        
-        df_media["timestamp"].replace(time_dict, inplace=True)
-        df_media = df_media.drop_duplicates(keep='last')
+    # df = pd.DataFrame({'col2': {0: 'a', 1: 1, 2: 2, 3: 3}, 'col1': {0: 'w', 1: 1.01, 2: 2.02, 3: 2.02}})
+    # di = {1: "A", 2: "B"}
+    # print(df)
+    # # df.replace({"col1": di})
+    # df["col1"].replace(time_dict, inplace=True)
+    # print(df)
 
-        media = Resource(df_media)
-        target = media.write('output/dp/media.csv')
+    df_media = pd.DataFrame(columns=cols)
+    df_media['mediaID'] = df_movieseq['Filename'].map(lambda x: str(x)[:-4]).astype(str)
+    df_media['deploymentID'] = df_movieseq['OpCode'].astype(str)
+    df_media['captureMethod'] = 'motionDetection'
+    df_media['timestamp'] = df_movieseq['Filename'].map(lambda x: str(x)[:-9]).astype('float')
+    df_media['filePath'] = 'https://data.csiro.au/collection/'
+    df_media['filePublic'] = True
+    df_media['fileName'] = df_movieseq['Filename']
+    df_media['fileMediatype'] = 'video/x-msvideo'
+    df_media['exifData'] = ''
+    df_media['favorite'] = ''
+    df_media['mediaComments'] = ''
+    
+    df_media["timestamp"].replace(time_dict, inplace=True)
+    df_media = df_media.drop_duplicates(keep='last')
 
-        # Print resulting schema and data
-        print(target.schema)
-        print(target.to_view())
+    context.write(df_media, 'media')
         
 # OpCode	PointIndex  Filename	    Frame	Time	   Period	PeriodTime	ImageCol	ImageRow	Family	        Genus	    Species	        Code	    Number	    Stage	Activity	Comment	Attribute9	Attribute10
 # 1.01	    0	        1.01_L373.avi	13293	8.862	    1	    0.018	    1257.16684	985.29851	Labridae	    Coris	    caudimacula	    37384092	1	        AD	    Passing			
@@ -164,93 +299,416 @@ def get_date_from_deployment():
     # pprint(name_list)
     
     
-def fix_date(dt, delta):
-    return pd.to_datetime(dt, 
-            format='%Y-%m-%dT%H:%M:%SZ') + pd.Timedelta(minutes=float(delta))
+def parse_deployment_start(dates, times):
+    # Metadata Date is 20190812 and Time is 09:23:00
+    return pd.to_datetime(dates.astype(str) + times.astype(str), format='%Y%m%d%H:%M:%S')
+
+
+def format_timestamp(datetimes):
+    return datetimes.dt.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def offset_minutes(datetimes, minutes):
+    # EventMeasure Time and PeriodTime are minutes since the start of the video,
+    # truncated to whole nanoseconds the same way pd.Timedelta(minutes=...) does
+    nanoseconds = np.trunc(minutes.astype(float) * 60 * 1e9)
+    return datetimes + pd.to_timedelta(nanoseconds, unit='ns')
     
-def create_observations(path, version):
-    cols = read_schema_field_names('observations', version)
-    filepath = find_resource(path, 'points')
-    # print(filepath)
-    with open(filepath) as points:
-        df_points = pd.read_table(points)
-        df_deployments = Resource(find_resource(path, 'metadata')).to_pandas()
-        df_points = pd.merge(df_points, df_deployments, left_on='OpCode', right_on='Sample', suffixes=(None, "_dep", ))
-        df_points['dateTime'] = pd.to_datetime(df_points['Date'].astype(str)+ df_points['Time_dep'].astype(str), format='%Y%m%d%H:%M:%S').apply(lambda x: x.strftime('%Y-%m-%dT%H:%M:%SZ'))
-        df_points['eventStart'] = df_points.apply(lambda row: fix_date(row['dateTime'], row['Time']), axis=1)
-        df_points['eventEnd'] = df_points.apply(lambda row: fix_date(row['dateTime'], row['Time']+ row['PeriodTime']), axis=1)
-        
-        df_observation = pd.DataFrame(columns=cols)
-        df_observation['observationID'] = df_points['Filename'].map(lambda x: str(x)[:-9]) + "-" + "points-" + df_points['PointIndex'].astype(str)  
-        df_observation['deploymentID'] = df_points['OpCode'].astype(str)
-        df_observation['eventID'] = "e_" + df_points['OpCode'].astype(str)
-        df_observation['eventStart'] = df_points['eventStart']
-        df_observation['eventEnd'] = df_points['eventEnd']
-        df_observation['observationLevel'] = "media"
-        df_observation['mediaID'] = df_points['Filename'].map(lambda x: str(x)[:-4])
-        df_observation['observationType'] = 'animal'
-        df_observation['cameraSetupType'] = ''
-        df_observation['taxonID'] = df_points['Code']
-        df_observation['scientificName'] = df_points['Species']
-        df_observation['count'] = df_points['Number']
-        df_observation['lifeStage'] = df_points['Stage'].map({'AD': 'adult'})
-        df_observation['sex'] = ''
-        df_observation['behavior'] = ''
-        df_observation['individualID'] = "ind_" + df_points['PointIndex'].astype(str) + "_" + df_points['Filename'].map(lambda x: str(x)[:-4])
-        df_observation['individualPositionRadius'] = ''
-        df_observation['individualPositionAngle'] = ''
-        df_observation['classificationMethod'] = 'human'
-        df_observation['classifiedBy'] = ''
-        df_observation['classificationTimestamp'] = ''
-        df_observation['classificationProbability'] = ''
-        df_observation['observationTags'] = ''
-        df_observation['observationComments'] = ''
-
-        media = Resource(df_observation)
-        target = media.write('output/dp/observations.csv')
+def build_observations(df_points, df_metadata, cols):
+    # the merge carries the parsed deploymentStart to every point. A left merge
+    # keeps the Points file order (an inner merge groups rows by OpCode on
+    # older pandas), so chunked output concatenates to the same file
+    df_points = pd.merge(df_points, df_metadata, how='left', left_on='OpCode', right_on='Sample', suffixes=(None, "_dep", ))
+    df_points = df_points[df_points['Sample'].notna()].reset_index(drop=True)
+    df_points['eventStart'] = offset_minutes(df_points['deploymentStart'], df_points['Time'])
+    df_points['eventEnd'] = offset_minutes(df_points['deploymentStart'], df_points['Time'] + df_points['PeriodTime'])
+    
+    df_observation = pd.DataFrame(columns=cols)
+    df_observation['observationID'] = df_points['Filename'].map(lambda x: str(x)[:-9]) + "-" + "points-" + df_points['PointIndex'].astype(str)  
+    df_observation['deploymentID'] = df_points['OpCode'].astype(str)
+    df_observation['eventID'] = "e_" + df_points['OpCode'].astype(str)
+    df_observation['eventStart'] = df_points['eventStart']
+    df_observation['eventEnd'] = df_points['eventEnd']
+    df_observation['observationLevel'] = "media"
+    df_observation['mediaID'] = df_points['Filename'].map(lambda x: str(x)[:-4])
+    df_observation['observationType'] = 'animal'
+    df_observation['cameraSetupType'] = ''
+    # unidentified points have no Code, an empty taxonID in csv as in Parquet
+    df_observation['taxonID'] = df_points['Code'].astype(str).where(df_points['Code'].notna(), '')
+    df_observation['scientificName'] = df_points['Species']
+    df_observation['count'] = df_points['Number']
+    df_observation['lifeStage'] = df_points['Stage'].map({'AD': 'adult'})
+    df_observation['sex'] = ''
+    df_observation['behavior'] = ''
+    df_observation['individualID'] = "ind_" + df_points['PointIndex'].astype(str) + "_" + df_points['Filename'].map(lambda x: str(x)[:-4])
+    df_observation['individualPositionRadius'] = ''
+    df_observation['individualPositionAngle'] = ''
+    df_observation['classificationMethod'] = 'human'
+    df_observation['classifiedBy'] = ''
+    df_observation['classificationTimestamp'] = ''
+    df_observation['classificationProbability'] = ''
+    df_observation['observationTags'] = ''
+    df_observation['observationComments'] = ''
+    return df_observation
 
-        # Print resulting schema and data
-        print(target.schema)
-        print(target.to_view())
+
+def widen_dtype(current, dtype):
+    if current is None or current == dtype:
+        return dtype
+    if pd.api.types.is_numeric_dtype(current) and pd.api.types.is_numeric_dtype(dtype) \
+            and not pd.api.types.is_bool_dtype(current) and not pd.api.types.is_bool_dtype(dtype):
+        return np.dtype('float64')
+    return np.dtype('object')
+
+
+def read_points_dtypes(filepath, chunksize):
+    # dtypes pandas would infer reading the whole file at once, so every
+    # chunk is typed (and written) the same way as the in-memory path
+    dtypes = {}
+    for df_points in pd.read_table(filepath, chunksize=chunksize):
+        for name, dtype in df_points.dtypes.items():
+            dtypes[name] = widen_dtype(dtypes.get(name), dtype)
+    return dtypes
+
+
+def write_observations_chunked(context, cols, target_path, chunksize):
+    filepath = context.find_resource('points')
+    dtypes = read_points_dtypes(filepath, chunksize)
+    part_path = str(Path(target_path).with_suffix(".part.csv"))
+    rows = 0
+    with open(target_path, 'wb') as target:
+        for index, df_points in enumerate(pd.read_table(filepath, chunksize=chunksize, dtype=dtypes)):
+            df_observation = build_observations(df_points, context.metadata, cols)
+            Resource(df_observation).write(part_path)
+            with open(part_path, 'rb') as part:
+                header = part.readline()
+                if index == 0:
+                    target.write(header)
+                shutil.copyfileobj(part, target)
+            rows += len(df_observation)
+            print(f"observations: {rows} rows written")
+    Path(part_path).unlink(missing_ok=True)
+    return rows
+
+
+def write_observations_chunked_parquet(context, cols, target_path, chunksize):
+    import pyarrow.parquet as pq
+
+    filepath = context.find_resource('points')
+    dtypes = read_points_dtypes(filepath, chunksize)
+    fields = read_schema('observations', context.version)['fields']
+    rows = 0
+    with pq.ParquetWriter(target_path, arrow_schema(fields), compression=PARQUET_COMPRESSION) as writer:
+        for df_points in pd.read_table(filepath, chunksize=chunksize, dtype=dtypes):
+            df_observation = build_observations(df_points, context.metadata, cols)
+            writer.write_table(to_arrow_table(df_observation, fields))
+            rows += len(df_observation)
+            print(f"observations: {rows} rows written")
+    return rows
+
+
+def create_observations(path, version, context=None, chunksize=None):
+    context = context or SurveyContext(path, version)
+    cols = context.field_names('observations')
+    target_path = context.output_path('observations')
+    if chunksize:
+        # stream Points so memory is bounded by the chunk size
+        if context.output_format == 'parquet':
+            write_observations_chunked_parquet(context, cols, target_path, chunksize)
+        else:
+            write_observations_chunked(context, cols, target_path, chunksize)
+        set_package_resource_format(context.output_dir, 'observations', context.output_format)
+        return
+
+    df_observation = build_observations(context.points, context.metadata, cols)
+    context.write(df_observation, 'observations')
         
-def create_datapackage(path, version):
-    profile = f"https://raw.githubusercontent.com/tdwg/camtrap-dp/{version}/camtrap-dp-profile.json"
-    response = urlopen(profile)
-    data_json = json.loads(response.read())
-    # print(data_json)
+RESOURCE_INPUTS = {
+    'deployments': ['metadata'],
+    'media': ['metadata', 'movieseq'],
+    'observations': ['metadata', 'points']
+}
 
-    filepath = find_resource(path, 'points')
-    # print(filepath)
 
-    with open('output/dp/datapackage.json') as json_file:
+def create_all(path, version, context=None, chunksize=None, force=False):
+    """Builds deployments, media and observations, skipping every resource
+    whose inputs, schema and output are unchanged since the build recorded
+    in the output folder manifest.
+
+    Args:
+        path (str): folder holding the EventMeasure exports
+        version (str): Camtrap DP version of the schemas
+        context (SurveyContext): shared survey inputs
+        chunksize (int): stream Points in chunks of this many rows
+        force (bool): rebuild every resource
+
+    Returns:
+        list: names of the rebuilt resources
+    """
+    context = context or SurveyContext(path, version)
+    manifest_path = Path(context.output_dir) / manifest.MANIFEST_NAME
+    build_manifest = manifest.load_manifest(manifest_path)
+    entries = build_manifest.setdefault('resources', {})
+    builders = {
+        'deployments': create_deployments,
+        'media': create_media,
+        'observations': partial(create_observations, chunksize=chunksize)
+    }
+
+    rebuilt = []
+    for name, builder in builders.items():
+        entry = entries.get(name, {})
+        inputs = {
+            resource_type: manifest.file_fingerprint(context.find_resource(resource_type),
+                                                     entry.get('inputs', {}).get(resource_type))
+            for resource_type in RESOURCE_INPUTS[name]
+        }
+        schema = {'version': version, 'sha256': manifest.sha256_json(read_schema(name, version))}
+        output_path = context.output_path(name)
+        if not force and manifest.is_up_to_date(entry, inputs, schema, output_path):
+            # a build in another format may have pointed datapackage.json elsewhere
+            set_package_resource_format(context.output_dir, name, context.output_format)
+            print(f"{name}: up to date, skipped")
+            continue
+
+        builder(path, version, context)
+        entries[name] = {'inputs': inputs, 'schema': schema, 'output': manifest.file_fingerprint(output_path)}
+        manifest.save_manifest(manifest_path, build_manifest)
+        rebuilt.append(name)
+    return rebuilt
+
+
+TAXON_COLUMNS = ['Family', 'Genus', 'Species', 'Code']
+
+
+def distinct_taxa(df_points):
+    # one row per CAAB code, first occurrence wins like the row by row merge did
+    df_taxa = df_points[TAXON_COLUMNS].dropna(subset=['Code'])
+    df_taxa = df_taxa[df_taxa['Code'] != 0]
+    return df_taxa.assign(Code=df_taxa['Code'].astype('int64')).drop_duplicates(subset='Code')
+
+
+def read_distinct_taxa(filepath, chunksize=None):
+    if not chunksize:
+        return distinct_taxa(pd.read_table(filepath, usecols=TAXON_COLUMNS))
+    return distinct_taxa(pd.concat(
+        distinct_taxa(df_points) for df_points in pd.read_table(filepath, usecols=TAXON_COLUMNS, chunksize=chunksize)))
+
+
+def taxon_entry(family, genus, species, code):
+    family, genus, species = (None if pd.isna(value) else value for value in (family, genus, species))
+    return {
+        "family": family,
+        "genus": genus,
+        "species": species,
+        "scientificName": " ".join(str(name) for name in (genus, species) if name is not None),
+        "taxonRank": "species",
+        "taxonID": int(code),
+        "taxonIDReference": f"https://www.marine.csiro.au/data/caab/taxon_report.cfm?caab_code={code}"
+    }
+
+
+def merge_taxonomic(taxonomic, taxa_frames):
+    """Appends the taxa of one or many surveys missing from taxonomic.
+
+    Args:
+        taxonomic (list): datapackage.json taxonomic entries, extended in place
+        taxa_frames (list): DataFrames of TAXON_COLUMNS, e.g. from distinct_taxa
+
+    Returns:
+        int: number of entries added
+    """
+    known_codes = {taxon.get("taxonID") for taxon in taxonomic}
+    frames = [df_taxa for df_taxa in taxa_frames if len(df_taxa)]
+    if not frames:
+        return 0
+    df_taxa = distinct_taxa(pd.concat(frames, ignore_index=True))
+    df_taxa = df_taxa[~df_taxa['Code'].isin(known_codes)].sort_values('Code')
+    taxonomic.extend(taxon_entry(*taxon) for taxon in df_taxa[TAXON_COLUMNS].itertuples(index=False))
+    return len(df_taxa)
+
+
+def update_taxonomic(output_dir, taxa_frames):
+    package_path = Path(output_dir) / 'datapackage.json'
+    with open(package_path) as json_file:
         data_json = json.load(json_file)
-        taxonomic = data_json.get("taxonomic")
-        taxonomic_code = [taxon.get("taxonID") for taxon in taxonomic]
-
-        with open(filepath) as points:
-            df_points = pd.read_table(points)
-            for point in df_points.itertuples():
-                code = int(point.Code) if not math.isnan(point.Code) else None
-                if code and code not in taxonomic_code:
-                    taxonomic_ins = {
-                        "family": point.Family,
-                        "genus": point.Genus,
-                        "species": point.Species,
-                        "scientificName": f"{point.Genus} {point.Species}",
-                        "taxonRank": "species",
-                        "taxonID": code,
-                        "taxonIDReference": f"https://www.marine.csiro.au/data/caab/taxon_report.cfm?caab_code={code}"
-                    }
-                    taxonomic.append(taxonomic_ins)
-                    taxonomic_code.append(code)
-            
-        with open('output/dp/datapackage.json', 'w') as fp:
-            json.dump(data_json, fp, indent=4)
-            
-            report = validate('output/dp/datapackage.json')
-            print(report)
-            # package = Package('output/dp/datapackage.json')
-            # pprint(package.extract())
+    added = merge_taxonomic(data_json.setdefault("taxonomic", []), taxa_frames)
+    print(f"taxonomic: {added} taxa added, {len(data_json['taxonomic'])} in total")
+    with open(package_path, 'w') as fp:
+        json.dump(data_json, fp, indent=4)
+    return package_path
+
+
+def create_datapackage(path, version, output_dir='output/dp', workers=None, quick=False):
+    filepath = find_resource(path, 'points')
+    package_path = update_taxonomic(output_dir, [read_distinct_taxa(filepath)])
+
+    report = validation.validate_package(package_path, workers, quick)
+    print(report)
+    # package = Package('output/dp/datapackage.json')
+    # pprint(package.extract())
+
+BATCH_RESOURCES = ['deployments', 'media', 'observations']
+
+
+def count_rows(path):
+    if str(path).endswith('.parquet'):
+        import pyarrow.parquet as pq
+        return pq.read_metadata(path).num_rows
+    with open(path) as fp:
+        return sum(1 for _ in fp) - 1
+
+
+def convert_survey(folder, survey, version, output_dir, chunksize=None, output_format='csv', force=False):
+    # runs in a worker process, logs go to the survey's own folder
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    start = time.perf_counter()
+    result = {'survey': survey, 'folder': folder, 'output_dir': output_dir, 'rows': 0, 'error': None}
+    with open(Path(output_dir) / 'convert.log', 'w') as log, redirect_stdout(log):
+        try:
+            context = SurveyContext(folder, version, survey, output_dir, output_format)
+            result['rebuilt'] = create_all(folder, version, context, chunksize, force)
+            result['rows'] = count_rows(context.output_path('observations'))
+
+            manifest_path = Path(output_dir) / manifest.MANIFEST_NAME
+            survey_manifest = manifest.load_manifest(manifest_path)
+            if 'observations' in result['rebuilt'] or 'taxa' not in survey_manifest:
+                # Points is already in memory unless it was streamed
+                if 'points' in context.__dict__:
+                    df_taxa = distinct_taxa(context.points)
+                else:
+                    df_taxa = read_distinct_taxa(context.find_resource('points'), chunksize)
+                survey_manifest['taxa'] = df_taxa.to_dict(orient='records')
+                manifest.save_manifest(manifest_path, survey_manifest)
+            result['taxa'] = pd.DataFrame(survey_manifest['taxa'], columns=TAXON_COLUMNS)
+            result['outputs'] = {
+                name: entry['output']['sha256'] for name, entry in survey_manifest['resources'].items()
+            }
+        except Exception as error:
+            traceback.print_exc(file=log)
+            result['error'] = f"{type(error).__name__}: {error}"
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+def merge_parquet_resources(output_dirs, output_dir):
+    import pyarrow.parquet as pq
+
+    # every survey file is typed by the same schema, so row groups concatenate
+    for name in BATCH_RESOURCES:
+        paths = [Path(survey_dir) / f"{name}.parquet" for survey_dir in output_dirs]
+        if not paths:
+            continue
+        with pq.ParquetWriter(Path(output_dir) / f"{name}.parquet", pq.read_schema(paths[0]),
+                              compression=PARQUET_COMPRESSION) as writer:
+            for path in paths:
+                writer.write_table(pq.read_table(path))
+        set_package_resource_format(output_dir, name, 'parquet')
+
+
+def merge_resources(output_dirs, output_dir, output_format='csv'):
+    if output_format == 'parquet':
+        merge_parquet_resources(output_dirs, output_dir)
+        return
+
+    # concatenates the per survey csv files, keeping the first header only
+    for name in BATCH_RESOURCES:
+        with open(Path(output_dir) / f"{name}.csv", 'wb') as target:
+            for index, survey_dir in enumerate(output_dirs):
+                with open(Path(survey_dir) / f"{name}.csv", 'rb') as source:
+                    header = source.readline()
+                    if index == 0:
+                        target.write(header)
+                    shutil.copyfileobj(source, target)
+        set_package_resource_format(output_dir, name, 'csv')
+
+
+def read_deployment_ids(survey_dir, output_format='csv'):
+    path = Path(survey_dir) / f"deployments.{output_format}"
+    if output_format == 'parquet':
+        return pd.read_parquet(path, columns=['deploymentID'])['deploymentID'].astype(str)
+    return pd.read_csv(path, usecols=['deploymentID'], dtype=str)['deploymentID']
+
+
+def duplicated_deployments(output_dirs, output_format='csv'):
+    # deploymentIDs of more than one survey, the primary key of the merged deployments
+    if not output_dirs:
+        return []
+    deployment_ids = pd.concat([read_deployment_ids(survey_dir, output_format) for survey_dir in output_dirs])
+    return sorted(deployment_ids[deployment_ids.duplicated()].unique())
+
+
+def batch(root, version, output_dir='output/dp', workers=None, chunksize=None, output_format='csv', force=False):
+    """Converts every survey found under root in a process pool and merges
+    the resources into one Camtrap DP package in output_dir.
+
+    Args:
+        root (str): folder searched recursively for *_Metadata.csv
+        version (str): Camtrap DP version of the schemas
+        output_dir (str): folder of the merged package
+        workers (int): number of worker processes, defaults to the cpu count
+        chunksize (int): stream Points in chunks of this many rows
+        output_format (str): csv or parquet
+        force (bool): rebuild surveys and the merged package even if unchanged
+
+    Returns:
+        tuple: one result dict per survey, with an error for failed ones, and
+            whether the merged package is up to date with the surveys
+    """
+    surveys = discover_surveys(root)
+    print(f"Found {len(surveys)} surveys under {root}")
+    start = time.perf_counter()
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(convert_survey, folder, survey, version,
+                            str(Path(output_dir) / 'surveys' / survey), chunksize, output_format, force)
+            for folder, survey in surveys
+        ]
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            status = f"failed, {result['error']}" if result['error'] else f"{result['rows']} observations"
+            print(f"[{len(results)}/{len(surveys)}] {result['survey']}: {status} ({result['seconds']:.1f}s)")
+
+    results.sort(key=lambda result: result['survey'])
+    converted = [result for result in results if not result['error']]
+    output_dirs = [result['output_dir'] for result in converted]
+    merged_path = Path(output_dir) / manifest.MANIFEST_NAME
+    merged_manifest = manifest.load_manifest(merged_path)
+    sources = {result['survey']: result['outputs'] for result in converted}
+    merged = [Path(output_dir) / f"{name}.{output_format}" for name in BATCH_RESOURCES]
+    duplicated = duplicated_deployments(output_dirs, output_format)
+    up_to_date = False
+    if not converted:
+        # an empty merge would truncate the resources of the previous package
+        print(f"No survey converted, kept the merged package in {output_dir}")
+    elif duplicated:
+        print(f"deploymentID used by more than one survey: {', '.join(duplicated)}, "
+              f"kept the merged package in {output_dir}")
+    elif not force and merged_manifest.get('sources') == sources and all(path.exists() for path in merged):
+        print("Merged package is up to date")
+        up_to_date = True
+    else:
+        merge_resources(output_dirs, output_dir, output_format)
+        up_to_date = True
+        if (Path(output_dir) / 'datapackage.json').exists():
+            update_taxonomic(output_dir, [result['taxa'] for result in converted])
+        merged_manifest['sources'] = sources
+        manifest.save_manifest(merged_path, merged_manifest)
+
+    seconds = time.perf_counter() - start
+    # surveys skipped as up to date took no work, they would inflate the rates
+    rebuilt = [result for result in converted if result['rebuilt']]
+    rows = sum(result['rows'] for result in rebuilt)
+    print(f"Converted {len(rebuilt)}/{len(results)} surveys ({len(converted) - len(rebuilt)} up to date), "
+          f"{rows} observations in {seconds:.1f}s "
+          f"({rows / seconds:.0f} observations/s, {len(rebuilt) / seconds:.2f} surveys/s)")
+    for result in results:
+        if result['error']:
+            print(f"Failed {result['survey']}: {result['error']} (see {result['output_dir']}/convert.log)")
+    return results, up_to_date
+
 
 def main():
     parser = argparse.ArgumentParser()
@@ -262,34 +720,78 @@ def main():
     media = subparser.add_parser("media")
     observations = subparser.add_parser("observations")
     all = subparser.add_parser("all")
+    batch_parser = subparser.add_parser("batch")
+    validate_parser = subparser.add_parser("validate")
     
-    schema.add_argument("-s", "--schema", type=str, required=True)
+    schema.add_argument("action", nargs="?", choices=["show", "prefetch"], default="show")
+    schema.add_argument("-s", "--schema", type=str, choices=list(schema_cache.SCHEMA_FILES))
     schema.add_argument("-v", "--version", type=str, required=True)
+    schema.add_argument("-d", "--dir", type=str, help="prefetch target directory, defaults to the local cache")
+    schema.add_argument("--refresh", action="store_true", help="download again even if already cached")
+    schema.add_argument("-p", "--package", type=str, default="output/dp/datapackage.json",
+                        help="prefetch also every schema and profile version this package refers to")
     datapackage.add_argument("-p", "--path", type=str, required=True)
     datapackage.add_argument("-v", "--version", type=str, required=True)
+    datapackage.add_argument("-w", "--workers", type=int, help="validation worker processes, defaults to the cpu count")
+    datapackage.add_argument("--quick", action="store_true", help="validate a random sample of rows only")
     deployments.add_argument("-p", "--path", type=str, required=True)
     deployments.add_argument("-v", "--version", type=str, required=True)
+    deployments.add_argument("-f", "--format", type=str, choices=["csv", "parquet"], default="csv")
     media.add_argument("-p", "--path", type=str, required=True)
     media.add_argument("-v", "--version", type=str, required=True)
+    media.add_argument("-f", "--format", type=str, choices=["csv", "parquet"], default="csv")
     observations.add_argument("-p", "--path", type=str, required=True)
     observations.add_argument("-v", "--version", type=str, required=True)
+    observations.add_argument("-f", "--format", type=str, choices=["csv", "parquet"], default="csv")
+    observations.add_argument("-c", "--chunksize", type=int, help="stream Points in chunks of this many rows")
     all.add_argument("-p", "--path", type=str, required=True)
     all.add_argument("-v", "--version", type=str, required=True)
+    all.add_argument("-f", "--format", type=str, choices=["csv", "parquet"], default="csv")
+    all.add_argument("-c", "--chunksize", type=int, help="stream Points in chunks of this many rows")
+    all.add_argument("--force", action="store_true", help="rebuild resources even if their inputs are unchanged")
+    batch_parser.add_argument("-r", "--root", type=str, required=True)
+    batch_parser.add_argument("-v", "--version", type=str, required=True)
+    batch_parser.add_argument("-f", "--format", type=str, choices=["csv", "parquet"], default="csv")
+    batch_parser.add_argument("-o", "--output", type=str, default="output/dp")
+    batch_parser.add_argument("-w", "--workers", type=int, help="worker processes, defaults to the cpu count")
+    batch_parser.add_argument("-c", "--chunksize", type=int, help="stream Points in chunks of this many rows")
+    batch_parser.add_argument("--force", action="store_true", help="rebuild surveys even if their inputs are unchanged")
+    validate_parser.add_argument("-p", "--path", type=str, default="output/dp/datapackage.json")
+    validate_parser.add_argument("-w", "--workers", type=int, help="worker processes, defaults to the cpu count")
+    validate_parser.add_argument("--quick", action="store_true", help="validate a random sample of rows only")
+    validate_parser.add_argument("--sample", type=int, default=validation.QUICK_SAMPLE, help="rows per resource in quick mode")
     
     args = parser.parse_args()
     if args.command == "schema":
-        read_schema(args.schema, args.version)
+        if args.action == "prefetch":
+            schema_cache.prefetch(args.version, [args.schema] if args.schema else None, args.dir, args.refresh)
+            if Path(args.package).exists():
+                schema_cache.prefetch_package(args.package, args.dir, args.refresh)
+        elif args.schema:
+            pprint(read_schema(args.schema, args.version))
+        else:
+            parser.error("schema show requires -s/--schema")
     if args.command == "datapackage":
-        create_datapackage(args.path, args.version)
+        create_datapackage(args.path, args.version, workers=args.workers, quick=args.quick)
     elif args.command == "deployments":
-        create_deployments(args.path, args.version)
+        create_deployments(args.path, args.version, SurveyContext(args.path, args.version, output_format=args.format))
     elif args.command == "media":
-        create_media(args.path, args.version)
+        create_media(args.path, args.version, SurveyContext(args.path, args.version, output_format=args.format))
     elif args.command == "observations":
-        create_observations(args.path, args.version)
+        context = SurveyContext(args.path, args.version, output_format=args.format)
+        create_observations(args.path, args.version, context, args.chunksize)
     elif args.command == "all":
-        create_deployments(args.path, args.version)
-        create_media(args.path, args.version)
-        create_observations(args.path, args.version)
+        context = SurveyContext(args.path, args.version, output_format=args.format)
+        create_all(args.path, args.version, context, args.chunksize, args.force)
+    elif args.command == "batch":
+        _, up_to_date = batch(args.root, args.version, args.output, args.workers, args.chunksize, args.format,
+                              args.force)
+        if not up_to_date:
+            sys.exit(1)
+    elif args.command == "validate":
+        report = validation.validate_package(args.path, args.workers, args.quick, args.sample)
+        print(report)
+        if not report.valid:
+            sys.exit(1)
 if __name__ == "__main__":
     main()
\ No newline at end of file
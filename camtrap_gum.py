@@ -1,12 +1,33 @@
 from sqlalchemy.orm import Session
 
-import csv
+import sys
+import json
+import hashlib
+import argparse
+from collections import defaultdict
+from itertools import chain
+from pathlib import Path
 import models
 import database
+import gum_async
+import gum_bulk
+import gum_direct
+import gum_mapping
+import gum_precheck
+import gum_export
+import gum_scheduler
+import gum_staging
+import gum_sync
+import gum_progress
+import gum_sqlite
+import manifest
+import validation
+from gum_mapping import MAPPINGS
 import pandas as pd
 from pprint import pprint
 from frictionless import Package
 from frictionless import Resource, Detector
+from sqlalchemy import exists
 from sqlalchemy.orm import make_transient
 
 
@@ -33,6 +54,51 @@ def get_event(media_id: str):
         )
 
 
+class IdentityCache:
+    """Loader scoped cache of the Location and Event keys inserted during a run,
+    so events find their location_id without a SELECT per row.
+
+    Keys missing from the cache (e.g. rows loaded by an earlier run) are
+    looked up in the database once and remembered.
+    """
+
+    def __init__(self):
+        self.locations = {}
+        self.events = {}
+        self.hits = {'location': 0, 'event': 0}
+        self.misses = {'location': 0, 'event': 0}
+
+    def add_location(self, location_id):
+        self.locations[str(location_id)] = str(location_id)
+
+    def add_event(self, event_id, location_id):
+        self.events[str(event_id)] = str(location_id)
+
+    def location_id(self, deployment_id):
+        key = str(deployment_id)
+        if key in self.locations:
+            self.hits['location'] += 1
+            return self.locations[key]
+        self.misses['location'] += 1
+        location = get_location(deployment_id)
+        self.locations[key] = location.location_id
+        return location.location_id
+
+    def event_location_id(self, event_id):
+        key = str(event_id)
+        if key in self.events:
+            self.hits['event'] += 1
+            return self.events[key]
+        self.misses['event'] += 1
+        event = get_event(event_id)
+        self.events[key] = event.location_id
+        return event.location_id
+
+    def report(self):
+        for kind in self.hits:
+            print(f"identity cache {kind}: {self.hits[kind]} hits, {self.misses[kind]} misses")
+
+
 def add_agent(
     agent_id: str,
     agent_type: str,
@@ -48,398 +114,246 @@ def add_agent(
 
 
 def add_georeference(resource: dict):
-    georeference = models.Georeference(
-        georeference_id = resource.get('deploymentID'),
-        location_id = resource.get('deploymentID'),
-        decimal_latitude = resource.get('latitude'),
-        decimal_longitude = resource.get('longitude'),
-        geodetic_datum = '',
-        coordinate_uncertainty_in_meters = resource.get('coordinateUncertainty'),
-        coordinate_precision = None,
-        point_radius_spatial_fit = None,
-        footprint_wkt = None,
-        footprint_srs = None,
-        footprint_spatial_fit = None,
-        georeferenced_by = None,
-        georeferenced_date = None,
-        georeference_protocol = None,
-        georeference_sources = None,
-        georeference_remarks = None,
-        preferred_spatial_representation = None,
-    )
-    return add_to_db(georeference)
-
-
-def add_location(resource: dict):
-    location = models.Location(
-        location_id = resource.get('deploymentID'),
-        parent_location_id = None,
-        higher_geography_id = None,
-        higher_geography = None,
-        continent = None,
-        water_body = None,
-        island_group = None,
-        island = None,
-        country = None,
-        country_code = None,
-        state_province = None,
-        county = None,
-        municipality = None,
-        locality = resource.get('locationName'),
-        minimum_elevation_in_meters = None,
-        maximum_elevation_in_meters = None,
-        minimum_distance_above_surface_in_meters = None,
-        maximum_distance_above_surface_in_meters = None,
-        minimum_depth_in_meters = None,
-        maximum_depth_in_meters = None,
-        vertical_datum = None,
-        location_according_to = None,
-        location_remarks = None,
-        accepted_georeference_id = None,
-        accepted_geological_context_id = None,
-    )
+    return add_to_db(MAPPINGS['georeference'].instance(resource))
+
+
+def add_location(resource: dict, cache: IdentityCache = None):
+    location = MAPPINGS['location'].instance(resource)
     add_to_db(location)
+    if cache:
+        cache.add_location(location.location_id)
     return location
-            
-
-def add_event_deployments(resource: dict):
-    location = get_location(resource.get('deploymentID'))
-    event = models.Event(
-        event_id = resource.get('deploymentID'),
-        parent_event_id = None,
-        dataset_id = 'ningaloo',
-        location_id = location.location_id,
-        protocol_id = None,
-        event_type = 'deployment',
-        event_name = None,
-        field_number = None,
-        event_date = resource.get('start'),
-        year = None,
-        month = None,
-        day = None,
-        verbatim_event_date = None,
-        verbatim_locality = None,
-        verbatim_elevation = None,
-        verbatim_depth = None,
-        verbatim_coordinates = None,
-        verbatim_latitude = None,
-        verbatim_longitude = None,
-        verbatim_coordinate_system = None,
-        verbatim_srs = None,
-        habitat = resource.get('habitat'),
-        protocol_description = None,
-        sample_size_value = None,
-        sample_size_unit = None,
-        event_effort = None,
-        field_notes = None,
-        event_remarks = resource.get('deploymentComments'),
-    )
-    return add_to_db(event)
-
-def add_event_media(resource: dict):
-    location = get_location(resource.get('deploymentID'))
-    event = models.Event(
-        event_id = resource.get('mediaID'),
-        parent_event_id = resource.get('deploymentID'),
-        dataset_id = 'ningaloo',
-        location_id = location.location_id,
-        protocol_id = None,
-        event_type = 'image capture',
-        event_name = None,
-        field_number = None,
-        event_date = resource.get('start'),
-        year = None,
-        month = None,
-        day = None,
-        verbatim_event_date = None,
-        verbatim_locality = None,
-        verbatim_elevation = None,
-        verbatim_depth = None,
-        verbatim_coordinates = None,
-        verbatim_latitude = None,
-        verbatim_longitude = None,
-        verbatim_coordinate_system = None,
-        verbatim_srs = None,
-        habitat = resource.get('habitat'),
-        protocol_description = None,
-        sample_size_value = None,
-        sample_size_unit = None,
-        event_effort = None,
-        field_notes = None,
-        event_remarks = resource.get('deploymentComments'),
-    )
-    return add_to_db(event)
-
-def add_event_media_observation(resource: dict):
-    event = get_event(resource.get('mediaID'))
-    event = models.Event(
-        event_id = resource.get('observationID'),
-        parent_event_id = resource.get('mediaID'),
-        dataset_id = 'ningaloo',
-        location_id = event.location_id,
-        protocol_id = None,
-        event_type = 'observation',
-        event_name = None,
-        field_number = None,
-        event_date = resource.get('start'),
-        year = None,
-        month = None,
-        day = None,
-        verbatim_event_date = None,
-        verbatim_locality = None,
-        verbatim_elevation = None,
-        verbatim_depth = None,
-        verbatim_coordinates = None,
-        verbatim_latitude = None,
-        verbatim_longitude = None,
-        verbatim_coordinate_system = None,
-        verbatim_srs = None,
-        habitat = resource.get('habitat'),
-        protocol_description = None,
-        sample_size_value = None,
-        sample_size_unit = None,
-        event_effort = None,
-        field_notes = None,
-        event_remarks = resource.get('deploymentComments'),
-    )
-    return add_to_db(event)
+
+
+def add_event_deployments(resource: dict, cache: IdentityCache = None):
+    if cache:
+        location_id = cache.location_id(resource.get('deploymentID'))
+    else:
+        location_id = get_location(resource.get('deploymentID')).location_id
+    event = add_to_db(MAPPINGS['deployment_event'].instance(resource, location_id=location_id))
+    if cache:
+        cache.add_event(event['event_id'], location_id)
+    return event
+
+
+def add_event_media(resource: dict, cache: IdentityCache = None):
+    if cache:
+        location_id = cache.location_id(resource.get('deploymentID'))
+    else:
+        location_id = get_location(resource.get('deploymentID')).location_id
+    event = add_to_db(MAPPINGS['media_event'].instance(resource, location_id=location_id))
+    if cache:
+        cache.add_event(event['event_id'], location_id)
+    return event
+
+
+def add_event_media_observation(resource: dict, cache: IdentityCache = None):
+    if cache:
+        location_id = cache.event_location_id(resource.get('mediaID'))
+    else:
+        location_id = get_event(resource.get('mediaID')).location_id
+    return add_to_db(MAPPINGS['observation_event'].instance(resource, location_id=location_id))
 
 
 def add_digital_entity(resource: dict):
-    digital_entity = models.DigitalEntity(
-        digital_entity_id = f"digent_{resource.get('mediaID')}",
-        digital_entity_type = 'MOVING_IMAGE',
-        access_uri = resource.get('filePath'),
-        web_statement = None,
-        format = resource.get('fileMediatype'),
-        license = None,
-        rights = None,
-        rights_uri = None,
-        access_rights = None,
-        rights_holder = None,
-        source = None,
-        source_uri = None,
-        creator = None,
-        created = resource.get('timestamp'),
-        modified = None,
-        language = None,
-        bibliographic_citation = None,
-        entity_id = f"digent_{resource.get('mediaID')}",
-        entity_type = 'DIGITAL_ENTITY',
-        dataset_id = 'ningaloo',
-        entity_name = resource.get('fileName'),
-        entity_remarks = resource.get('mediaComments')
-    )
-    return add_to_db(digital_entity)
+    return add_to_db(MAPPINGS['digital_entity'].instance(resource))
+
 
 def add_organism(resource: dict):
-    entity = models.Organism(
-        organism_id = f"org_{resource.get('observationID')}",
-        organism_scope = 'individual',
-        accepted_identification_id = None,
-        
-        material_entity_id = f"org_{resource.get('observationID')}",
-        material_entity_type = 'Organism',
-        preparations = None,
-        disposition = None,
-        institution_code = None,
-        institution_id = None,
-        collection_code = None,
-        collection_id = None,
-        owner_institution_code = None,
-        catalog_number = None,
-        record_number = None,
-        recorded_by = None,
-        recorded_by_id = None,
-        associated_references = None,
-        associated_sequences = None,
-        other_catalog_numbers = None,
-        entity_id = f"org_{resource.get('observationID')}",
-        entity_type = 'MATERIAL_ENTITY',
-        dataset_id = 'ningaloo',
-        entity_name = None,
-        entity_remarks = None
-    )
-    return add_to_db(entity)
+    return add_to_db(MAPPINGS['organism'].instance(resource))
+
 
 def add_identification(resource: dict):
-    entity = models.Identification(
-        
-        identification_id = resource.get('individualID'),
-        organism_id = f"org_{resource.get('observationID')}",
-        identification_type = resource.get('classificationMethod'),
-        taxon_formula = resource.get('taxonID'),
-        verbatim_identification = resource.get('scientificName'),
-        type_status = None,
-        identified_by = resource.get('classifiedBy'),
-        identified_by_id = resource.get('classifiedBy'),
-        date_identified = resource.get('classificationTimestamp'),
-        identification_references = None,
-        identification_verification_status = None,
-        identification_remarks = None,
-        type_designation_type = None,
-        type_designated_by = None
-    )
-    return add_to_db(entity)
+    return add_to_db(MAPPINGS['identification'].instance(resource))
 
 
 def add_taxon(resource: dict):
-    entity = models.Taxon(
-        
-        taxon_id = resource.get('taxonID'),
-        scientific_name = resource.get('scientificName'),
-        scientific_name_authorship = None,
-        name_according_to = None,
-        name_according_to_id = None,
-        taxon_rank = None,
-        taxon_source = None,
-        scientific_name_id = None,
-        taxon_remarks = None,
-        parent_taxon_id = None,
-        taxonomic_status = None,
-        kingdom = None,
-        phylum = None,
-        _class = None,
-        order = None,
-        family = None,
-        subfamily = None,
-        genus = None,
-        subgenus = None,
-        accepted_scientific_name =None
-    )
-    return add_to_db(entity)
-    
+    return add_to_db(MAPPINGS['taxon'].instance(resource))
+
 
 def add_taxon_identification(resource: dict):
-    entity = models.TaxonIdentification(
-        taxon_id = resource.get('taxonID'),
-        identification_id = resource.get('individualID'),
-        taxon_order = None,
-        taxon_authority = None
-    )
-    return add_to_db(entity)
+    return add_to_db(MAPPINGS['taxon_identification'].instance(resource))
+
 
 def add_assertions_lifestage(resource: dict):
-    entity = models.Assertion(
-        assertion_id = f"assert_lifeStage_{resource.get('observationID')}",
-        assertion_target_id = f"org_{resource.get('observationID')}",
-        assertion_target_type = 'ORGANISM', #Column(Enum('ENTITY', 'MATERIAL_ENTITY', 'MATERIAL_GROUP', 'ORGANISM', 'DIGITAL_ENTITY', 'GENETIC_SEQUENCE', 'EVENT', 'OCCURRENCE', 'LOCATION', 'GEOREFERENCE', 'GEOLOGICAL_CONTEXT', 'PROTOCOL', 'AGENT', 'COLLECTION', 'ENTITY_RELATIONSHIP', 'IDENTIFICATION', 'TAXON', 'REFERENCE', 'AGENT_GROUP', 'ASSERTION', 'CHRONOMETRIC_AGE', name='common_targets'), nullable=False, index=True)
-        assertion_parent_assertion_id = None,
-        assertion_type = 'lifeStage',
-        assertion_made_date = resource.get('classificationTimestamp'),
-        assertion_effective_date = None,
-        assertion_value = resource.get('lifeStage'),
-        assertion_value_numeric = None,
-        assertion_unit = None, 
-        assertion_by_agent_name = None, 
-        assertion_by_agent_id = None, 
-        assertion_protocol = None, 
-        assertion_protocol_id = None, 
-        assertion_remarks = None
-    )
-    return add_to_db(entity)
+    return add_to_db(MAPPINGS['lifestage_assertion'].instance(resource))
+
 
 def add_assertions_count(resource: dict):
-    entity = models.Assertion(
-        assertion_id = f"assert_count_{resource.get('observationID')}",
-        assertion_target_id = f"org_{resource.get('observationID')}",
-        assertion_target_type = 'ORGANISM', #Column(Enum('ENTITY', 'MATERIAL_ENTITY', 'MATERIAL_GROUP', 'ORGANISM', 'DIGITAL_ENTITY', 'GENETIC_SEQUENCE', 'EVENT', 'OCCURRENCE', 'LOCATION', 'GEOREFERENCE', 'GEOLOGICAL_CONTEXT', 'PROTOCOL', 'AGENT', 'COLLECTION', 'ENTITY_RELATIONSHIP', 'IDENTIFICATION', 'TAXON', 'REFERENCE', 'AGENT_GROUP', 'ASSERTION', 'CHRONOMETRIC_AGE', name='common_targets'), nullable=False, index=True)
-        assertion_parent_assertion_id = None,
-        assertion_type = 'organismQuantity',
-        assertion_made_date = resource.get('classificationTimestamp'),
-        assertion_effective_date = None,
-        assertion_value = None,
-        assertion_value_numeric = resource.get('count'),
-        assertion_unit = 'individual', 
-        assertion_by_agent_name = None, 
-        assertion_by_agent_id = None, 
-        assertion_protocol = None, 
-        assertion_protocol_id = None, 
-        assertion_remarks = None
-    )
-    return add_to_db(entity)
-
-def manage_location(package):
-    with package.get_resource('deployments') as resource:
-        for row in resource.row_stream:   
-            deployment = row.to_dict(json=False)
-            add_location(resource=deployment)
-            add_georeference(resource=deployment)
-
-def manage_event(package):
-    # deployments = package.get_resource('deployments')
-    # pprint(deployments.read_rows())
-    # print(type(deployments))
-    # pprint(deployments.header)
-    with package.get_resource('deployments') as resource:
-        for row in resource.row_stream:   
-            # print(f'Row: {row}')
-            deployment = row.to_dict(json=False)
-            event_deployment = add_event_deployments(resource=deployment)
-            print(f"event_deployment: {event_deployment}")
-                       
-    # media = package.get_resource('media')
-    # pprint(media.read_rows())
-    # pprint(media.header)
-    with package.get_resource('media') as resource:
-        for row in resource.row_stream:   
-            media_dict = row.to_dict(json=False)
-            event_media = add_event_media(resource=media_dict)
-            print(f"event_media: {event_media}")
-            
-    # media_observation = package.get_resource('media-observations')
-    # pprint(media_observation.read_rows())
-    # pprint(media_observation.header)
-    with package.get_resource('media-observations') as resource:
-        for row in resource.row_stream:   
-            media_observation_dict = row.to_dict(json=False)
-            event_media_observation = add_event_media_observation(resource=media_observation_dict)
-            print(f"event_media_observation: {event_media_observation}")
-             
-def manage_taxon_identification(package):
-    with package.get_resource('media-observations') as resource:
-        for row in resource.row_stream:   
-            media_observation_dict = row.to_dict(json=False)
-            with database.SessionLocal() as db_session:
-                exists = db_session.query(models.Taxon).filter(models.Taxon.taxon_id == str(media_observation_dict.get('taxonID'))).first() is not None
-                if not exists:
-                    taxon = add_taxon(resource=media_observation_dict)
-                    print(f"taxon: {taxon}")
-                
-                    taxon_identification = add_taxon_identification(resource=media_observation_dict)
-                    print(f"taxon_identification: {taxon_identification}")
-                
-            
-def manage_assertion(package):
-    with package.get_resource('media-observations') as resource:
-        for row in resource.row_stream:   
-            media_observation_dict = row.to_dict(json=False)
-            
-            assertions_count = add_assertions_count(resource=media_observation_dict)
-            print(f"assertions_count: {assertions_count}")
-            
-            assertions_lifestage = add_assertions_lifestage(resource=media_observation_dict)
-            print(f"assertions_lifestage: {assertions_lifestage}")
-
-def manage_entity(package):
-    with package.get_resource('media') as resource:
-        for row in resource.row_stream:   
-            media_dict = row.to_dict(json=False)
-            digital_entity_media = add_digital_entity(resource=media_dict)
-            print(f"digital_entity_media: {digital_entity_media}")
-        print("End add digital entitty\n\n\n\n")
-    
-    with package.get_resource('media-observations') as resource:
-        for row in resource.row_stream:   
-            media_observation_dict = row.to_dict(json=False)
-            
-            organism_media_observation = add_organism(resource=media_observation_dict)
-            print(f"organism_media_observation: {organism_media_observation}")
-            
-            
-            identification_media_observation = add_identification(resource=media_observation_dict)
-            print(f"identification_media_observation: {identification_media_observation}")
-            
+    return add_to_db(MAPPINGS['count_assertion'].instance(resource))
+
+
+def in_deployments(resource: dict, deployments=None):
+    return deployments is None or str(resource.get('deploymentID')) in deployments
+
+
+class TaxonStage:
+    """Collects the distinct taxa and every identification -> taxon link while
+    the observations are streamed, and writes them set based afterwards.
+    """
+
+    def __init__(self):
+        self.taxa = {}
+        self.links = {}
+
+    def add(self, resource: dict):
+        if resource.get('taxonID') is None:
+            return
+        taxon = MAPPINGS['taxon'].values(resource)
+        self.taxa.setdefault(str(taxon['taxon_id']), taxon)
+        link = MAPPINGS['taxon_identification'].values(resource)
+        if link['identification_id'] is not None:
+            key = (str(link['taxon_id']), str(link['identification_id']))
+            self.links.setdefault(key, link)
+
+    def write_taxa(self, connection):
+        """Inserts the taxa with one executemany INSERT ... ON CONFLICT DO NOTHING
+        so taxa loaded by earlier runs are kept.
+
+        Args:
+            connection (Connection): open transaction the rows are written in
+        """
+        if self.taxa:
+            connection.execute(database.insert(models.Taxon.__table__).on_conflict_do_nothing(),
+                               list(self.taxa.values()))
+        print(f"taxon: {len(self.taxa)} distinct taxa")
+
+    def write_links(self, connection):
+        """Inserts the identification -> taxon links, see write_taxa."""
+        if self.links:
+            connection.execute(database.insert(models.TaxonIdentification.__table__).on_conflict_do_nothing(),
+                               list(self.links.values()))
+        print(f"taxon_identification: {len(self.links)} links")
+
+    def rows(self):
+        """Yields the (table, values) rows of the taxa and links, see gum_mapping.columns."""
+        for table, rows in ((models.Taxon.__table__, self.taxa), (models.TaxonIdentification.__table__, self.links)):
+            columns = gum_mapping.columns(table)
+            for values in rows.values():
+                yield table, tuple(values[name] for name in columns)
+
+    def writers(self):
+        return {models.Taxon.__tablename__: self.write_taxa,
+                models.TaxonIdentification.__tablename__: self.write_links}
+
+    def write(self, connection):
+        self.write_taxa(connection)
+        self.write_links(connection)
+
+
+def stream_rows(package, deployments=None, cache=None, taxa=None, start=None):
+    """Reads every resource once and fans each decoded row out to the
+    builders of all the GUM tables it feeds.
+
+    Rows up to the start offset of their resource, loaded by an interrupted
+    run, are still built so the cache and the taxa are complete, but are not
+    yielded.
+
+    Args:
+        package (Package): Camtrap DP package
+        deployments (set): only load these deploymentIDs, all when None
+        cache (IdentityCache): location and event keys, filled while streaming
+        taxa (TaxonStage): collects the taxa of the observations, written by the caller
+        start (dict): number of rows already loaded per resource name
+
+    Yields:
+        tuple: resource name, row number (from 1), (table, values) rows built
+            by gum_mapping, parents before children
+    """
+    cache = cache or IdentityCache()
+    start = start or {}
+    for row_number, deployment in enumerate(read_rows(package, 'deployments'), 1):
+        if not in_deployments(deployment, deployments):
+            continue
+        cache.add_location(deployment.get('deploymentID'))
+        location_id = cache.location_id(deployment.get('deploymentID'))
+        cache.add_event(deployment.get('deploymentID'), location_id)
+        if row_number > start.get('deployments', 0):
+            yield 'deployments', row_number, gum_mapping.resource_rows('deployments', deployment,
+                                                                       location_id=location_id)
+
+    for row_number, media_dict in enumerate(read_rows(package, 'media'), 1):
+        if not in_deployments(media_dict, deployments):
+            continue
+        location_id = cache.location_id(media_dict.get('deploymentID'))
+        cache.add_event(media_dict.get('mediaID'), location_id)
+        if row_number > start.get('media', 0):
+            yield 'media', row_number, gum_mapping.resource_rows('media', media_dict, location_id=location_id)
+
+    for row_number, media_observation_dict in enumerate(read_rows(package, 'media-observations'), 1):
+        if not in_deployments(media_observation_dict, deployments):
+            continue
+        if taxa is not None:
+            taxa.add(media_observation_dict)
+        if row_number <= start.get('media-observations', 0):
+            continue
+        location_id = cache.event_location_id(media_observation_dict.get('mediaID'))
+        yield 'media-observations', row_number, gum_mapping.resource_rows(
+            'media-observations', media_observation_dict, location_id=location_id)
+
+
+def stream_table_rows(package, deployments=None, cache=None, taxa=None):
+    """Yields the (table, values) rows of stream_rows one by one."""
+    for _, _, rows in stream_rows(package, deployments, cache, taxa):
+        yield from rows
+
+
+BATCH_SIZE = 5000
+
+
+class BatchWriters:
+    """Buffers the rows of every GUM table and inserts the buffers together
+    once batch_size rows are buffered, at the end of a resource row, with
+    one executemany INSERT per table, parents first, in one transaction
+    whose foreign keys are checked at commit.
+
+    Args:
+        batch_size (int): rows buffered before a flush
+        progress (gum_progress.LoadProgress): records the last row of each
+            resource in the transaction of its batch, for --resume
+    """
+
+    def __init__(self, batch_size=BATCH_SIZE, progress=None):
+        self.batch_size = batch_size
+        self.progress = progress
+        self.pending = defaultdict(list)
+        self.counts = defaultdict(int)
+        self.positions = {}
+        self.size = 0
+
+    def write(self, table, values):
+        self.pending[table.name].append(values)
+        self.size += 1
+
+    def row_done(self, resource_name, row_number):
+        self.positions[resource_name] = row_number
+        if self.size >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.size and not self.positions:
+            return
+        with database.engine.begin() as connection:
+            database.defer_constraints(connection)
+            for name in gum_scheduler.load_order(self.pending):
+                table = database.Base.metadata.tables[name]
+                rows = self.pending.pop(name)
+                columns = gum_mapping.columns(table)
+                connection.execute(table.insert(), [dict(zip(columns, values)) for values in rows])
+                self.counts[name] += len(rows)
+            if self.progress:
+                self.progress.save(connection, self.positions)
+        print(f"flushed {self.size} rows")
+        self.size = 0
+        self.positions = {}
+
+    def close(self):
+        self.flush()
+        for table, count in self.counts.items():
+            if count:
+                print(f"{table}: {count} rows")
+
+
 def row2dict(row):
     d = {}
     for column in row.__table__.columns:
@@ -462,36 +376,286 @@ def add_to_db(entity):
         return entity_dict
    
    
-def manage_export():
-    entity_list = [models.Location, models.Georeference, models.Event, models.Entity, models.DigitalEntity, models.MaterialEntity, models.Organism, models.Assertion, models.Identification, models.Taxon, models.TaxonIdentification]
-    for entity in entity_list:
-        export_to_csv(entity)
-    
+EXPORT_MODELS = [models.Location, models.Georeference, models.Event, models.Entity, models.DigitalEntity, models.MaterialEntity, models.Organism, models.Assertion, models.Identification, models.Taxon, models.TaxonIdentification]
+
+
+def manage_export(workers=1, compression=None):
+    gum_export.export_tables([entity.__table__ for entity in EXPORT_MODELS], workers=workers, compression=compression)
+
+
 def export_to_csv(entity):
-    with database.SessionLocal() as db_session:
-        with open(f"output/gum/{entity.__table__.name}.csv", 'w') as outfile:
-            outcsv = csv.writer(outfile, delimiter=',',quotechar='"', quoting = csv.QUOTE_MINIMAL)
-            records = db_session.query(entity).all()
-            header = entity.__table__.columns.keys()
-            print(header)
-            outcsv.writerow(header)
-            for record in records:
-                outcsv.writerow([getattr(record, "_class" if c == 'class' else c) for c in header ])
+    gum_export.export_tables([entity.__table__])
+
+
+# rows of a Parquet resource held in memory at a time
+PARQUET_BATCH_SIZE = 10000
+
+
+def parquet_rows(path, batch_size=PARQUET_BATCH_SIZE):
+    # already typed by the schema the file was written with, one record batch at a time
+    import pyarrow.parquet as pq
+
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size):
+        yield from batch.to_pylist()
+
+
+def open_package(folder='output/dp'):
+    """Opens the Camtrap DP package of folder from its datapackage.json: every
+    resource is read from the file its descriptor points at, csv or Parquet,
+    and typed by the schema it declares instead of one inferred from the data.
+
+    Args:
+        folder (str): Camtrap DP package folder
+
+    Returns:
+        Package: package of the deployments, media and observations
+    """
+    resources = validation.package_resources(Path(folder) / 'datapackage.json')
+    return Package({'resources': [{'name': name, 'path': resource['place'], 'schema': resource['schema']}
+                                  for name, resource in resources.items()]}, basepath=folder)
+
+
+GUM_RESOURCES = ['deployments', 'media', 'media-observations']
+
+
+def get_resource(package, resource_name):
+    # the package resource of a gum_mapping resource, e.g. observations for media-observations
+    return package.get_resource(gum_mapping.package_resource_name(resource_name, package.resource_names))
+
+
+def read_rows(package, resource_name):
+    """Yields the rows of a resource as dicts of typed values, None when empty.
+
+    Csv files are parsed by frictionless with the declared schema, Parquet
+    files were written typed by it and are read by record batch with pyarrow,
+    without casting again.
+
+    Args:
+        package (Package): Camtrap DP package, see open_package
+        resource_name (str): key of gum_mapping.RESOURCE_MAPPINGS, e.g. 'media-observations'
+
+    Yields:
+        dict: value per field name
+    """
+    resource = get_resource(package, resource_name)
+    if resource.format == 'parquet':
+        yield from parquet_rows(resource.normpath)
+        return
+    with resource:
+        for row in resource.row_stream:
+            yield row.to_dict(json=False)
+
+
+def deployment_digests(package):
+    """Hashes the deployment, media and observation rows of every deployment
+    so a reload only touches the deployments whose rows changed.
+
+    Args:
+        package (Package): Camtrap DP package
+
+    Returns:
+        dict: sha256 of the rows keyed by deploymentID
+    """
+    digests = defaultdict(hashlib.sha256)
+    for resource_name in GUM_RESOURCES:
+        for row_dict in read_rows(package, resource_name):
+            digest = digests[str(row_dict.get('deploymentID'))]
+            digest.update(resource_name.encode())
+            digest.update(json.dumps(row_dict, sort_keys=True, default=str).encode())
+    return {deployment_id: digest.hexdigest() for deployment_id, digest in digests.items()}
+
+
+def package_digests(package, gum_manifest):
+    """Returns the deployment digests of a package, reusing the ones of the
+    manifest when datapackage.json and the resource files are unchanged so a
+    sync with nothing to do does not decode every row.
+
+    Args:
+        package (Package): Camtrap DP package
+        gum_manifest (dict): output/gum manifest of the previous load
+
+    Returns:
+        tuple: digests keyed by deploymentID and fingerprints keyed by file
+    """
+    paths = {'datapackage.json': Path(package.basepath) / 'datapackage.json'}
+    for resource_name in GUM_RESOURCES:
+        paths[resource_name] = get_resource(package, resource_name).normpath
+    previous = gum_manifest.get('files') or {}
+    files = {name: manifest.file_fingerprint(path, previous.get(name)) for name, path in paths.items()}
+    if 'deployments' in gum_manifest and manifest.same_content(files, previous):
+        return gum_manifest['deployments'], files
+    return deployment_digests(package), files
+
+
+def changed_deployments(digests, previous):
+    changed = {deployment_id for deployment_id, digest in digests.items() if previous.get(deployment_id) != digest}
+    # deployments dropped from the package only need deleting
+    return changed | (set(previous) - set(digests))
+
+
+def sync_rows(package, deployments, cache, taxa):
+    for table, values in stream_table_rows(package, deployments, cache, taxa):
+        yield table, dict(zip(gum_mapping.columns(table), values))
+    # complete once every observation has been streamed
+    for values in taxa.links.values():
+        yield models.TaxonIdentification.__table__, values
+
+
+def delete_unidentified_taxa(connection):
+    """Deletes the taxa no identification links to any more, e.g. once a sync
+    changed the last observation of a taxon, as a reload would not create them."""
+    taxon = models.Taxon.__table__
+    links = models.TaxonIdentification.__table__
+    result = connection.execute(taxon.delete().where(~exists().where(links.c.taxon_id == taxon.c.taxon_id)))
+    if result.rowcount:
+        print(f"taxon: {result.rowcount} taxa no longer identified deleted")
+
+
+def sync(package, deployments):
+    """Brings the rows of deployments in line with the package, writing only
+    the rows that were added, changed or removed.
+
+    Args:
+        package (Package): Camtrap DP package
+        deployments (set): changed deploymentIDs, removed ones included
+    """
+    cache = IdentityCache()
+    taxa = TaxonStage()
+    gum_sync.sync_deployments(deployments, sync_rows(package, deployments, cache, taxa),
+                              {models.Taxon.__tablename__: taxa.write_taxa}, delete_unidentified_taxa)
+    cache.report()
+
+
+def load(package, deployments=None, bulk=False, workers=1, checkpoint=False, resume=False, asynchronous=False):
+    """Loads the deployments of the package.
+
+    Args:
+        package (Package): Camtrap DP package
+        deployments (set): only load these deploymentIDs, all when None
+        bulk (bool): COPY every table at the end instead of inserting batches
+        workers (int): with bulk, number of tables loaded at the same time,
+            asynchronous, number of pooled connections
+        checkpoint (bool): record the progress of the batched load, see gum_progress
+        resume (bool): continue from the checkpoints of an interrupted batched load
+        asynchronous (bool): load with gum_async into tables without foreign keys, e.g. staging ones
+    """
+    cache = IdentityCache()
+    taxa = TaxonStage()
+    if asynchronous:
+        # the taxa are complete once every observation has been streamed
+        rows = chain(stream_table_rows(package, deployments, cache, taxa), taxa.rows())
+        counts = gum_async.load_rows(rows, workers)
+        for table, count in counts.items():
+            print(f"{table}: {count} rows")
+    elif bulk:
+        rows = stream_table_rows(package, deployments, cache, taxa)
+        counts = gum_bulk.copy_rows(rows, taxa.writers(), workers)
+        for table, count in counts.items():
+            print(f"{table}: {count} rows")
+    else:
+        progress = gum_progress.LoadProgress(resume) if checkpoint or resume else None
+        writers = BatchWriters(progress=progress)
+        start = progress.offsets if progress else None
+        for resource_name, row_number, rows in stream_rows(package, deployments, cache, taxa, start):
+            for table, values in rows:
+                writers.write(table, values)
+            writers.row_done(resource_name, row_number)
+        writers.close()
+        # ON CONFLICT DO NOTHING, rewriting them after a resume is harmless
+        with database.engine.begin() as connection:
+            taxa.write(connection)
+    cache.report()
+
+
+def exit_on_errors(errors):
+    for error in errors:
+        print(error)
+    if errors:
+        sys.exit(1)
+
+
+def precheck(skip=False, folder='output/dp'):
+    # rejects a package the database would refuse before anything is written
+    if skip:
+        return
+    exit_on_errors(gum_precheck.check_package(folder))
 
 
 def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--full", action="store_true", help="reload every deployment into staging tables swapped in at the end")
+    parser.add_argument("--bulk", action="store_true", help="load with COPY in one transaction instead of row by row")
+    parser.add_argument("--resume", action="store_true",
+                        help="continue an interrupted full reload after its last committed batch")
+    parser.add_argument("--async", dest="asynchronous", action="store_true",
+                        help="reload everything with asyncpg, decoding the package while batches are written")
+    parser.add_argument("-w", "--workers", type=int, default=1,
+                        help="number of tables exported, and with --bulk loaded, at the same time; "
+                             "indexes built and foreign keys validated at the same time after a reload; "
+                             "with --async, pooled connections")
+    parser.add_argument("--compression", choices=["gzip", "zstd"], help="compress the exported csv files")
+    parser.add_argument("--database-url",
+                        help=f"SQLAlchemy url of the GUM database, e.g. sqlite:///output/gum/gum.sqlite "
+                             f"(default ${database.DATABASE_URL_ENV}, else the docker compose Postgres)")
+    parser.add_argument("--no-precheck", action="store_true",
+                        help="skip the in-memory check of the package against the GUM constraints before loading")
+    parser.add_argument("--direct", action="store_true",
+                        help="write the GUM csv files straight from the package, without a database")
+    args = parser.parse_args()
+
+    # every mode reads each resource, even a sync with nothing to load
+    exit_on_errors(gum_precheck.check_resources('output/dp'))
+    if args.direct:
+        gum_direct.write_tables([entity.__table__ for entity in EXPORT_MODELS], 'output/dp',
+                                compression=args.compression)
+        return
+
+    if args.asynchronous and (args.bulk or args.resume):
+        parser.error("--async loads on its own, without --bulk or --resume")
+    database.configure(args.database_url)
+    if not database.is_postgres():
+        if args.bulk or args.resume or args.asynchronous:
+            parser.error("--bulk, --resume and --async need the Postgres backend")
+        gum_sqlite.create_schema(database.engine)
+
     # package = Package('output/datapackage.json')
-    package = Package('output/dp/*.csv')
+    package = open_package('output/dp')
     # pprint(package.extract())
 
-    database.truncate_db()
-    manage_location(package)
-    manage_event(package)
-    manage_entity(package)
-    manage_assertion(package)
-    manage_taxon_identification(package)
+    manifest_path = Path('output/gum') / manifest.MANIFEST_NAME
+    gum_manifest = manifest.load_manifest(manifest_path)
+    digests, files = package_digests(package, gum_manifest)
+    database_name = database.engine.url.render_as_string(hide_password=True)
+
+    # the digests describe what the database the manifest was written for holds
+    if (args.full or args.resume or args.asynchronous
+            or gum_manifest.get('database') != database_name or 'deployments' not in gum_manifest):
+        precheck(args.no_precheck)
+        resume = args.resume and not args.bulk and gum_staging.has_progress()
+        if args.resume and not resume:
+            print("No interrupted batched load to resume, reloading everything")
+        if database.is_postgres():
+            # built aside and swapped in, readers keep the previous load meanwhile
+            with gum_staging.staging_load(resume, args.workers):
+                load(package, bulk=args.bulk, workers=args.workers, checkpoint=not args.asynchronous, resume=resume,
+                     asynchronous=args.asynchronous)
+        else:
+            database.truncate_db()
+            load(package)
+    else:
+        changed = changed_deployments(digests, gum_manifest['deployments'])
+        if not changed:
+            print("GUM database is up to date")
+            return
+        precheck(args.no_precheck)
+        print(f"Synchronising {len(changed)} changed deployments")
+        sync(package, changed)
     
-    manage_export()
+    manage_export(args.workers, args.compression)
+    gum_manifest['database'] = database_name
+    gum_manifest['deployments'] = digests
+    gum_manifest['files'] = files
+    manifest.save_manifest(manifest_path, gum_manifest)
     
     
         
@@ -1,4 +1,10 @@
-from sqlalchemy import create_engine
+import os
+import sqlite3
+from decimal import Decimal
+from contextlib import contextmanager
+
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.engine import Engine
@@ -17,6 +23,12 @@ def truncate_db():
     meta = Base.metadata
     con = engine.connect()
     trans = con.begin()
+    if not is_postgres():
+        # foreign keys are initially deferred there, see gum_sqlite
+        for table in reversed(meta.sorted_tables):
+            con.execute(table.delete())
+        trans.commit()
+        return
     for table in meta.sorted_tables:
         con.execute(f'ALTER TABLE "{table.name}" DISABLE TRIGGER ALL;')
         con.execute(table.delete())
@@ -45,22 +57,102 @@ def create_db_engine(db_url: str, db_name: str, user: str, password: str, host:
 
 Base = declarative_base()
 
-engine = create_db_engine(
-    db_url = 'postgresql+psycopg2',
-    db_name = 'bruvs_ningloo',
-    user = 'postgres',
-    password = 'postgres',
-    host = '127.0.0.1',
-    port = '5432',
-)
+# schema the unqualified table names of every transaction resolve to, see use_schema
+load_schema = None
+
+
+def set_search_path(connection):
+    if load_schema:
+        # public stays on the path for the enum types
+        connection.exec_driver_sql(f'SET LOCAL search_path TO "{load_schema}", public')
+
+
+@contextmanager
+def use_schema(schema):
+    """Points the transactions begun inside the block, ORM sessions and
+    COPY included, at the tables of another schema, e.g. a staging load.
+
+    Args:
+        schema (str): schema name
+    """
+    global load_schema
+    previous, load_schema = load_schema, schema
+    try:
+        yield
+    finally:
+        load_schema = previous
+
+
+def enable_foreign_keys(dbapi_connection, connection_record):
+    # off by default in SQLite, the sync relies on ON DELETE CASCADE
+    dbapi_connection.execute('PRAGMA foreign_keys = ON')
+
+
+DATABASE_URL_ENV = 'CAMTRAP_GUM_DATABASE_URL'
 
 SessionLocal = sessionmaker()
-SessionLocal.configure(
-    autocommit=False,
-    autoflush=False,
-    binds={
-        Base: engine,
-    },
-)
+engine = None
+
+
+def configure(url=None):
+    """Points engine and SessionLocal at a database.
+
+    Args:
+        url (str): SQLAlchemy url, e.g. sqlite:///output/gum/gum.sqlite for the
+            embedded backend; CAMTRAP_GUM_DATABASE_URL, else the docker compose
+            Postgres, when None
+
+    Returns:
+        Engine: the new engine
+    """
+    global engine
+    url = url or os.environ.get(DATABASE_URL_ENV)
+    if url:
+        engine = create_engine(url, echo=False)
+    else:
+        engine = create_db_engine(
+            db_url = 'postgresql+psycopg2',
+            db_name = 'bruvs_ningloo',
+            user = 'postgres',
+            password = 'postgres',
+            host = '127.0.0.1',
+            port = '5432',
+        )
+    if is_postgres():
+        event.listen(engine, 'begin', set_search_path)
+    else:
+        event.listen(engine, 'connect', enable_foreign_keys)
+        # numeric ids parsed by frictionless go into text columns, as Postgres casts them
+        sqlite3.register_adapter(Decimal, str)
+    SessionLocal.configure(
+        autocommit=False,
+        autoflush=False,
+        binds={
+            Base: engine,
+        },
+    )
+    return engine
+
+
+def is_postgres():
+    return engine.dialect.name == 'postgresql'
+
+
+def insert(table):
+    """INSERT of the engine's dialect, with on_conflict_do_nothing and
+    on_conflict_do_update on both Postgres and SQLite."""
+    return postgresql.insert(table) if is_postgres() else sqlite.insert(table)
+
+
+def defer_constraints(executable):
+    """Defers the foreign key checks of the transaction to its commit.
+    SQLite foreign keys are created initially deferred instead.
+
+    Args:
+        executable (Session or Connection): open transaction
+    """
+    if is_postgres():
+        executable.execute(text('SET CONSTRAINTS ALL DEFERRED'))
 
 
+configure()
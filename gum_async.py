@@ -0,0 +1,139 @@
+import asyncio
+import threading
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal
+
+import database
+import gum_mapping
+
+
+# batches waiting per table before the producer blocks
+QUEUE_SIZE = 4
+
+
+def asyncpg_dsn(url):
+    # the engine url without its SQLAlchemy driver, e.g. postgresql+psycopg2://
+    return url.set(drivername='postgresql').render_as_string(hide_password=False)
+
+
+def record_value(column, value):
+    """Brings a value built from the package to the python type asyncpg
+    encodes for the column, as Postgres casts the text psycopg2 sends:
+    numeric ids into text columns, ISO strings into timestamps, ...
+    """
+    if value is None:
+        return None
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        return value
+    if python_type is Decimal:
+        return Decimal(str(value))
+    if python_type is datetime:
+        if isinstance(value, str):
+            value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        # timestamp without time zone columns keep the wall clock time
+        return value.replace(tzinfo=None)
+    if python_type in (int, str):
+        return python_type(value)
+    return value
+
+
+def record_columns(table):
+    return [table.c[name] for name in gum_mapping.columns(table)]
+
+
+def produce(rows, queues, loop, batch_size, writers, stop):
+    """Decodes and converts the rows in a thread, handing full batches to
+    the queue of their table. Blocks while a queue is full so memory stays
+    bounded, and gives up once stop is set by a failed writer.
+    """
+    def put(table_name, batch):
+        asyncio.run_coroutine_threadsafe(queues[table_name].put(batch), loop).result()
+
+    columns = {}
+    batches = defaultdict(list)
+    try:
+        for table, values in rows:
+            if stop.is_set():
+                return
+            if table.name not in columns:
+                columns[table.name] = record_columns(table)
+            batch = batches[table.name]
+            batch.append(tuple(map(record_value, columns[table.name], values)))
+            if len(batch) >= batch_size:
+                put(table.name, batches.pop(table.name))
+        for table_name, batch in batches.items():
+            put(table_name, batch)
+    finally:
+        if not stop.is_set():
+            for queue_name in queues:
+                for _ in range(writers):
+                    put(queue_name, None)
+
+
+async def write_batches(pool, table, queue, schema, counts):
+    """Copies the batches of one table, each on a pooled connection in its own transaction."""
+    columns = gum_mapping.columns(table)
+    while True:
+        batch = await queue.get()
+        if batch is None:
+            return
+        async with pool.acquire() as connection:
+            await connection.copy_records_to_table(table.name, records=batch, columns=columns, schema_name=schema)
+        counts[table.name] += len(batch)
+
+
+async def drain(queues, producer):
+    # frees the producer blocked on a full queue so it sees stop and returns
+    while not producer.done():
+        for queue in queues.values():
+            while not queue.empty():
+                queue.get_nowait()
+        await asyncio.sleep(0.01)
+
+
+async def load_rows_async(rows, dsn, schema, workers, batch_size):
+    import asyncpg
+
+    loop = asyncio.get_running_loop()
+    queues = {table.name: asyncio.Queue(maxsize=QUEUE_SIZE) for table in gum_mapping.COLUMNS}
+    stop = threading.Event()
+    counts = defaultdict(int)
+    async with asyncpg.create_pool(dsn, min_size=1, max_size=workers) as pool:
+        tasks = [asyncio.create_task(write_batches(pool, table, queues[table.name], schema, counts))
+                 for table in gum_mapping.COLUMNS for _ in range(workers)]
+        producer = loop.run_in_executor(None, produce, rows, queues, loop, batch_size, workers, stop)
+        try:
+            await asyncio.gather(producer, *tasks)
+        except BaseException:
+            stop.set()
+            for task in tasks:
+                task.cancel()
+            await drain(queues, producer)
+            raise
+    return dict(counts)
+
+
+def load_rows(rows, workers=4, batch_size=5000):
+    """Loads GUM rows with asyncpg, overlapping the decoding of the package
+    with the round trips to the database.
+
+    A thread decodes the rows and fills a bounded queue per table while
+    workers writer tasks per table copy its batches on a pool of workers
+    connections, each batch committed on its own. Batches of a table and of
+    its parents land in any order, so the tables must not check foreign
+    keys: load into the staging schema (gum_staging.staging_load), whose
+    foreign keys are added once loaded.
+
+    Args:
+        rows (iterable): (table, values) rows, e.g. from camtrap_gum.stream_table_rows
+        workers (int): pooled connections, and writers per table
+        batch_size (int): rows per COPY
+
+    Returns:
+        dict: number of rows copied per table
+    """
+    dsn = asyncpg_dsn(database.engine.url)
+    return asyncio.run(load_rows_async(rows, dsn, database.load_schema, workers, batch_size))
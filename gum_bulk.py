@@ -0,0 +1,115 @@
+import tempfile
+from datetime import date, datetime
+from collections import defaultdict
+from functools import partial
+
+from sqlalchemy import text
+
+import database
+import gum_mapping
+import gum_scheduler
+
+
+def copy_value(value):
+    """Formats a value for COPY text format, None being NULL.
+
+    Args:
+        value: python value of a model attribute
+
+    Returns:
+        str: escaped COPY field
+    """
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, (datetime, date)):
+        value = value.isoformat()
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+# bytes of COPY text kept in memory per table before it spills to a temporary file
+COPY_BUFFER_SIZE = 16 * 1024 * 1024
+# bytes sent to the server per COPY message
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+class CopyBuffer:
+    """Collects the rows built by gum_mapping as COPY text, one buffer per
+    table held in memory up to max_size bytes and spooled to a temporary file
+    beyond, so a bulk load does not hold whole tables in memory."""
+
+    def __init__(self, max_size=None):
+        self.max_size = COPY_BUFFER_SIZE if max_size is None else max_size
+        self.columns = {}
+        self.buffers = {}
+        self.counts = defaultdict(int)
+
+    def add(self, table, values):
+        if table.name not in self.buffers:
+            self.columns[table.name] = gum_mapping.columns(table)
+            self.buffers[table.name] = tempfile.SpooledTemporaryFile(self.max_size, mode='w+', newline='')
+        self.buffers[table.name].write('\t'.join(map(copy_value, values)) + '\n')
+        self.counts[table.name] += 1
+
+    def copy_table(self, connection, table_name):
+        """Streams the buffer of one table with COPY FROM STDIN, COPY_CHUNK_SIZE
+        bytes at a time.
+
+        Returns:
+            int: number of rows copied
+        """
+        buffer = self.buffers[table_name]
+        buffer.seek(0)
+        columns = ', '.join(f'"{name}"' for name in self.columns[table_name])
+        cursor = connection.connection.cursor()
+        cursor.copy_expert(f'COPY "{table_name}" ({columns}) FROM STDIN', buffer, COPY_CHUNK_SIZE)
+        cursor.close()
+        return self.counts[table_name]
+
+    def copy(self, connection):
+        """Streams every buffer with COPY FROM STDIN, parents before children."""
+        for name in gum_scheduler.load_order(self.buffers):
+            self.copy_table(connection, name)
+
+    def close(self):
+        # removes the temporary files of the spilled tables
+        for buffer in self.buffers.values():
+            buffer.close()
+
+
+def copy_rows(rows, writers=None, workers=1):
+    """Loads GUM rows with COPY.
+
+    With a single worker every table is loaded in one transaction, foreign
+    keys deferred to the commit so the location/georeference cycle and rows
+    loaded later in the same transaction are accepted. With more workers the
+    tables are loaded by gum_scheduler, one transaction per table and
+    independent tables at the same time.
+
+    Args:
+        rows (iterable): (table, values) rows, e.g. from camtrap_gum.stream_table_rows
+        writers (dict): callable(connection) per table name for tables written
+            another way, e.g. camtrap_gum.TaxonStage.writers()
+        workers (int): number of tables loaded at the same time
+
+    Returns:
+        dict: number of rows copied per table
+    """
+    buffer = CopyBuffer()
+    try:
+        for table, values in rows:
+            buffer.add(table, values)
+
+        tasks = {name: partial(buffer.copy_table, table_name=name) for name in buffer.buffers}
+        tasks.update(writers or {})
+        if workers > 1:
+            gum_scheduler.run(tasks, gum_scheduler.table_dependencies(tasks), workers)
+        else:
+            with database.engine.begin() as connection:
+                connection.execute(text('SET CONSTRAINTS ALL DEFERRED'))
+                for name in gum_scheduler.load_order(tasks):
+                    tasks[name](connection)
+    finally:
+        buffer.close()
+    return dict(buffer.counts)
@@ -0,0 +1,204 @@
+import json
+from datetime import datetime
+from decimal import Decimal
+from pathlib import Path
+
+import pandas as pd
+from sqlalchemy import DateTime, Enum, Integer, Numeric, String
+
+import gum_export
+import gum_mapping
+
+
+def resource_paths(folder):
+    # file of every resource of datapackage.json, csv or Parquet
+    with open(Path(folder) / 'datapackage.json') as fp:
+        descriptor = json.load(fp)
+    return {resource['name']: Path(folder) / resource['path']
+            for resource in descriptor.get('resources', []) if isinstance(resource.get('path'), str)}
+
+
+def read_resource(folder, name):
+    """Reads a Camtrap DP resource as text, empty fields as None, from the
+    csv or Parquet file its datapackage.json entry points at.
+
+    Args:
+        folder (str): Camtrap DP package folder
+        name (str): key of gum_mapping.RESOURCE_MAPPINGS, e.g. 'media-observations'
+            for the observations resource
+
+    Returns:
+        DataFrame: one str or None column per field
+    """
+    paths = resource_paths(folder)
+    path = paths[gum_mapping.package_resource_name(name, paths)]
+    if path.suffix == '.parquet':
+        df = pd.read_parquet(path)
+        for column in df.columns:
+            if pd.api.types.is_datetime64_any_dtype(df[column]):
+                df[column] = df[column].dt.strftime('%Y-%m-%dT%H:%M:%SZ')
+            df[column] = df[column].astype(object).where(df[column].notna(), None).map(
+                lambda value: value if value is None else str(value))
+        return df
+    df = pd.read_csv(path, dtype=str, keep_default_na=False)
+    return df.where(df != '', None)
+
+
+def field(df, name):
+    # resource.get(name) of the row builders, None when the field is missing
+    if name in df.columns:
+        return df[name]
+    return pd.Series(None, index=df.index, dtype=object)
+
+
+def source_values(source, df, params):
+    """Evaluates a gum_mapping source for every row of a resource."""
+    if isinstance(source, gum_mapping.Field):
+        values = field(df, source.name)
+        return values if source.default is None else values.where(values.notna(), source.default)
+    if isinstance(source, gum_mapping.Const):
+        return source.value
+    if isinstance(source, gum_mapping.Param):
+        return params[source.name]
+    values = pd.Series('', index=df.index, dtype=object)
+    for literal, name in source.parts:
+        values = values + literal
+        if name:
+            values = values + field(df, name).astype(str)
+    return values
+
+
+def table_frame(table, names, sources, df, params):
+    """Returns the rows of a table, constants repeated and every column not
+    mapped NULL, or its server default when left out of the mapped columns,
+    in the __table__.columns order."""
+    frame = pd.DataFrame(index=df.index)
+    for column in table.columns:
+        if column.name not in names:
+            value = column.server_default.arg.text
+        elif column.name in sources:
+            value = source_values(sources[column.name], df, params)
+        else:
+            value = None
+        if isinstance(value, pd.Series):
+            frame[column.name] = value.astype(object).where(value.notna(), None)
+        else:
+            frame[column.name] = pd.Series(value, index=df.index, dtype=object)
+    return frame
+
+
+def mapping_frames(name, df, **params):
+    mapping = gum_mapping.MAPPINGS[name]
+    return {table: table_frame(table, mapping.columns[table], mapping.sources, df, params)
+            for table in mapping.tables}
+
+
+def resource_frames(resource_name, df, **params):
+    # every row of the resource feeds each of its mappings
+    for name in gum_mapping.RESOURCE_MAPPINGS[resource_name]:
+        yield mapping_frames(name, df, **params)
+
+
+def timestamp_text(value):
+    # timestamp without time zone columns keep the wall clock time
+    return datetime.fromisoformat(value.replace('Z', '+00:00')).replace(tzinfo=None).isoformat(sep=' ')
+
+
+def timestamptz_text(value):
+    return gum_export.utc_text(datetime.fromisoformat(value.replace('Z', '+00:00')))
+
+
+def csv_column(column, values):
+    """Formats a column of text values as the database export writes them."""
+    present = values.notna()
+    text = values[present]
+    if isinstance(column.type, Numeric):
+        text = text.map(lambda value: format(Decimal(value).normalize(), 'f'))
+    elif isinstance(column.type, DateTime):
+        text = text.map(timestamptz_text if column.type.timezone else timestamp_text)
+    elif isinstance(column.type, Integer):
+        text = text.astype(int).astype(str)
+    else:
+        text = text.astype(str)
+        quoted = (text == '') | text.str.contains('[,"\r\n]')
+        text = text.where(~quoted, '"' + text.str.replace('"', '""', regex=False) + '"')
+    return text.reindex(values.index, fill_value='')
+
+
+def sort_keys(table, frame):
+    # primary key order of the database export, text keys in byte order
+    keys = []
+    for column in table.primary_key.columns:
+        if isinstance(column.type, String) and not isinstance(column.type, Enum):
+            keys.append(frame[column.name].astype(str))
+        else:
+            keys.append(frame[column.name].astype(int))
+    return pd.DataFrame({str(i): key.values for i, key in enumerate(keys)}, index=frame.index)
+
+
+def write_table(table, frame, output_dir, compression=None):
+    order = sort_keys(table, frame).sort_values(list(map(str, range(len(table.primary_key.columns))))).index
+    frame = frame.loc[order]
+    columns = [csv_column(column, frame[column.name]) for column in table.columns]
+    lines = columns[0].str.cat(columns[1:], sep=',') if len(frame) else pd.Series([], dtype=str)
+    path = gum_export.export_path(table, output_dir, compression)
+    with gum_export.open_output(path, compression) as outfile:
+        outfile.write((','.join(table.columns.keys()) + '\n').encode())
+        outfile.write(''.join(line + '\n' for line in lines).encode())
+    print(f"Wrote {len(frame)} {table.name} rows to {path}")
+    return path
+
+
+def build_tables(folder):
+    """Maps the deployments, media and observations of a package to the rows
+    of the GUM tables with the gum_mapping spec, one column at a time.
+    Joined inheritance models give a frame per table (entity, material_entity,
+    organism, ...).
+
+    Args:
+        folder (str): Camtrap DP package folder
+
+    Returns:
+        dict: DataFrame per table
+    """
+    deployments = read_resource(folder, 'deployments')
+    media = read_resource(folder, 'media')
+    observations = read_resource(folder, 'media-observations')
+    # the location of an observation is the one of its media event
+    media_location = pd.Series(field(media, 'deploymentID').values, index=field(media, 'mediaID').values)
+    media_location = media_location[~media_location.index.duplicated()]
+    # distinct taxa and identification -> taxon links, as camtrap_gum.TaxonStage keeps them
+    taxa = observations[field(observations, 'taxonID').notna()]
+    links = taxa[field(taxa, 'individualID').notna()].drop_duplicates(['taxonID', 'individualID'])
+
+    tables = {}
+    for frames in [
+        *resource_frames('deployments', deployments, location_id=field(deployments, 'deploymentID')),
+        *resource_frames('media', media, location_id=field(media, 'deploymentID')),
+        *resource_frames('media-observations', observations,
+                         location_id=field(observations, 'mediaID').map(media_location)),
+        mapping_frames('taxon', taxa.drop_duplicates('taxonID')),
+        mapping_frames('taxon_identification', links),
+    ]:
+        for table, frame in frames.items():
+            tables.setdefault(table, []).append(frame)
+    return {table: pd.concat(frames, ignore_index=True) for table, frames in tables.items()}
+
+
+def write_tables(tables, folder='output/dp', output_dir='output/gum', compression=None):
+    """Writes output/gum/<table>.csv straight from the package, without a
+    database: the same files as a load followed by the export.
+
+    Args:
+        tables (list): tables to write
+        folder (str): Camtrap DP package folder
+        output_dir (str): folder of the csv files
+        compression (str): None, 'gzip' or 'zstd'
+
+    Returns:
+        list: paths of the written files
+    """
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    frames = build_tables(folder)
+    return [write_table(table, frames[table], output_dir, compression) for table in tables]
+
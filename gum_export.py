@@ -0,0 +1,155 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from pathlib import Path
+
+from sqlalchemy import DateTime, Enum, String, select, text
+
+import database
+
+
+COMPRESSION_SUFFIXES = {None: '', 'gzip': '.gz', 'zstd': '.zst'}
+
+
+def order_term(column):
+    # byte order of text keys, as SQLite sorts them, whatever the database collation
+    if isinstance(column.type, String) and not isinstance(column.type, Enum):
+        return f'"{column.name}" COLLATE "C"'
+    return f'"{column.name}"'
+
+
+def copy_to_sql(table):
+    # the columns are listed so the csv keeps the __table__.columns order, rows
+    # come in primary key order so every backend writes the same file
+    columns = ', '.join(f'"{name}"' for name in table.columns.keys())
+    order = ', '.join(order_term(column) for column in table.primary_key.columns)
+    return f'COPY (SELECT {columns} FROM "{table.name}" ORDER BY {order}) TO STDOUT WITH (FORMAT csv, HEADER)'
+
+
+def csv_field(value):
+    """Formats a value as COPY ... (FORMAT csv) does: NULL as an empty field,
+    empty strings and fields with a delimiter, quote or line break quoted.
+    """
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        value = 't' if value else 'f'
+    elif isinstance(value, datetime):
+        value = value.isoformat(sep=' ')
+    elif isinstance(value, date):
+        value = value.isoformat()
+    elif isinstance(value, (Decimal, float)):
+        # SQLite numerics come back as floats or Decimals padded to 10 places
+        value = format(Decimal(str(value)).normalize(), 'f')
+    value = str(value)
+    if value == '' or any(char in value for char in ',"\r\n'):
+        return '"' + value.replace('"', '""') + '"'
+    return value
+
+
+def utc_text(value):
+    """Formats a timestamp with time zone as Postgres prints it with the
+    session time zone set to UTC, naive values being UTC already."""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.isoformat(sep=' ') + '+00'
+
+
+def utc_field(value):
+    return '' if value is None else utc_text(value)
+
+
+def write_rows(connection, table, outfile, batch_size=10000):
+    # what COPY TO STDOUT writes, for the backends without it
+    columns = table.columns.keys()
+    # SQLite gives the timestamp with time zone values back naive
+    formats = [utc_field if isinstance(column.type, DateTime) and column.type.timezone else csv_field
+               for column in table.columns]
+    outfile.write((','.join(map(csv_field, columns)) + '\n').encode())
+    result = connection.execute(select(*table.columns).order_by(*table.primary_key.columns))
+    for rows in result.partitions(batch_size):
+        outfile.write(''.join(','.join(field(value) for field, value in zip(formats, row)) + '\n'
+                              for row in rows).encode())
+
+
+def export_table(connection, table, outfile):
+    """Streams a table into a csv file with COPY TO STDOUT, memory use does
+    not depend on the number of rows. Other backends stream the rows of a
+    SELECT formatted the same way.
+
+    Args:
+        connection (Connection): open database connection
+        table (Table): table to export, e.g. models.Assertion.__table__
+        outfile: binary file object the csv is written to
+    """
+    if connection.dialect.name != 'postgresql':
+        write_rows(connection, table, outfile)
+        return
+    cursor = connection.connection.cursor()
+    # timestamps with time zone are written in UTC whatever the server's time zone
+    cursor.execute("SET TIME ZONE 'UTC'")
+    cursor.copy_expert(copy_to_sql(table), outfile)
+    cursor.close()
+
+
+def open_output(path, compression=None):
+    if compression is None:
+        return open(path, 'wb')
+    import pyarrow as pa
+    return pa.output_stream(str(path), compression=compression)
+
+
+def export_path(table, output_dir, compression=None):
+    return Path(output_dir) / f"{table.name}.csv{COMPRESSION_SUFFIXES[compression]}"
+
+
+def write_table(connection, table, output_dir, compression=None):
+    path = export_path(table, output_dir, compression)
+    with open_output(path, compression) as outfile:
+        export_table(connection, table, outfile)
+    print(f"Exported {table.name} to {path}")
+    return path
+
+
+def write_table_in_snapshot(snapshot_id, table, output_dir, compression=None):
+    with database.engine.connect() as connection:
+        with connection.begin():
+            connection.execute(text('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY'))
+            connection.execute(text(f"SET TRANSACTION SNAPSHOT '{snapshot_id}'"))
+            return write_table(connection, table, output_dir, compression)
+
+
+def export_tables(tables, output_dir='output/gum', workers=1, compression=None):
+    """Exports every table to <output_dir>/<table name>.csv[.gz|.zst].
+
+    With more than one worker the tables are exported at the same time on
+    separate connections. They all read the snapshot exported by a
+    REPEATABLE READ transaction kept open until the last table is written,
+    so the files are consistent with each other as a single connection
+    export would be. The embedded SQLite backend exports on one connection.
+
+    Args:
+        tables (list): tables to export
+        output_dir (str): folder of the csv files
+        workers (int): number of tables exported at the same time
+        compression (str): None, 'gzip' or 'zstd'
+
+    Returns:
+        list: paths of the written files
+    """
+    if compression not in COMPRESSION_SUFFIXES:
+        raise ValueError(f"Unknown compression {compression}, expected one of gzip, zstd")
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    with database.engine.connect() as connection:
+        with connection.begin():
+            if not database.is_postgres():
+                # a single embedded connection reads one consistent state
+                return [write_table(connection, table, output_dir, compression) for table in tables]
+            connection.execute(text('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY'))
+            if workers <= 1:
+                return [write_table(connection, table, output_dir, compression) for table in tables]
+            snapshot_id = connection.execute(text('SELECT pg_export_snapshot()')).scalar()
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(write_table_in_snapshot, snapshot_id, table, output_dir, compression)
+                           for table in tables]
+                return [future.result() for future in futures]
@@ -0,0 +1,288 @@
+from string import Formatter
+
+from sqlalchemy import inspect
+
+import models
+
+
+class Field:
+    """Value of a field of the Camtrap DP row, default when missing, e.g.
+    for NOT NULL columns of optional fields."""
+
+    def __init__(self, name, default=None):
+        self.name = name
+        self.default = default
+
+    def getter(self):
+        name, default = self.name, self.default
+        if default is None:
+            return lambda resource, params: resource.get(name)
+        return lambda resource, params: default if resource.get(name) is None else resource.get(name)
+
+
+class Const:
+    """Same value for every row."""
+
+    def __init__(self, value):
+        self.value = value
+
+    def getter(self):
+        value = self.value
+        return lambda resource, params: value
+
+
+class Template:
+    """str.format template of fields of the row, e.g. 'org_{observationID}'."""
+
+    def __init__(self, template):
+        self.template = template
+        self.parts = [(literal, name) for literal, name, _, _ in Formatter().parse(template)]
+
+    def getter(self):
+        pattern = ''.join(literal.replace('{', '{{').replace('}', '}}') + ('{}' if name else '')
+                          for literal, name in self.parts)
+        names = [name for _, name in self.parts if name]
+        return lambda resource, params: pattern.format(*[resource.get(name) for name in names])
+
+
+class Param:
+    """Value given by the loader for every row, e.g. the location_id the
+    IdentityCache resolved for its event."""
+
+    def __init__(self, name):
+        self.name = name
+
+    def getter(self):
+        name = self.name
+        return lambda resource, params: params.get(name)
+
+
+def null(resource, params):
+    return None
+
+
+def table_columns(table, sources):
+    # unmapped server default columns are left out, as an ORM insert would
+    return [column.name for column in table.columns if column.name in sources or column.server_default is None]
+
+
+class Mapping:
+    """Declares how a Camtrap DP row maps to a GUM model: a Field, Const,
+    Template or Param per target column, every other column being NULL.
+
+    Columns of joined inheritance models (Organism, DigitalEntity, ...) are
+    given together. Every source is turned into a getter once, rows then
+    returns a tuple of values per table of the mapper, in the columns order,
+    so loaders never build a mapped object per row.
+
+    Args:
+        model: models.* class
+        sources (dict): Field, Const, Template or Param per column name
+    """
+
+    def __init__(self, model, sources):
+        self.model = model
+        self.sources = sources
+        mapper = inspect(model)
+        unknown = set(sources) - {column.name for table in mapper.tables for column in table.columns}
+        if unknown:
+            raise ValueError(f"{model.__name__} has no columns {sorted(unknown)}")
+        # base tables first, e.g. entity, material_entity, organism
+        self.tables = [base.local_table for base in reversed(list(mapper.iterate_to_root()))]
+        self.attributes = {column.name: mapper.get_property_by_column(column).key
+                           for table in self.tables for column in table.columns}
+        self.columns = {table: table_columns(table, sources) for table in self.tables}
+        self.getters = [(table, [sources[name].getter() if name in sources else null for name in self.columns[table]])
+                        for table in self.tables]
+
+    def rows(self, resource, **params):
+        """Returns a (table, values) tuple per table of the mapper, base tables
+        first. Params of other mappings are accepted so a resource's mappings
+        share a call.
+        """
+        return [(table, tuple([getter(resource, params) for getter in getters])) for table, getters in self.getters]
+
+    def values(self, resource, **params):
+        """Returns the values of the row per column name, every table included."""
+        values = {}
+        for table, row in self.rows(resource, **params):
+            values.update(zip(self.columns[table], row))
+        return values
+
+    def instance(self, resource, **params):
+        """Builds the models.* instance of the row, for the ORM."""
+        return self.model(**{self.attributes[name]: value for name, value in self.values(resource, **params).items()})
+
+
+UNIDENTIFIED = 'unidentified'
+
+EVENT = {
+    'dataset_id': Const('ningaloo'),
+    'location_id': Param('location_id'),
+    'event_date': Field('start'),
+    'habitat': Field('habitat'),
+    'event_remarks': Field('deploymentComments'),
+}
+
+MAPPINGS = {
+    'location': Mapping(models.Location, {
+        'location_id': Field('deploymentID'),
+        'locality': Field('locationName'),
+    }),
+    'georeference': Mapping(models.Georeference, {
+        'georeference_id': Field('deploymentID'),
+        'location_id': Field('deploymentID'),
+        'decimal_latitude': Field('latitude'),
+        'decimal_longitude': Field('longitude'),
+        'geodetic_datum': Const(''),
+        'coordinate_uncertainty_in_meters': Field('coordinateUncertainty'),
+    }),
+    'deployment_event': Mapping(models.Event, {
+        **EVENT,
+        'event_id': Field('deploymentID'),
+        'event_type': Const('deployment'),
+    }),
+    'media_event': Mapping(models.Event, {
+        **EVENT,
+        'event_id': Field('mediaID'),
+        'parent_event_id': Field('deploymentID'),
+        'event_type': Const('image capture'),
+    }),
+    'observation_event': Mapping(models.Event, {
+        **EVENT,
+        'event_id': Field('observationID'),
+        'parent_event_id': Field('mediaID'),
+        'event_type': Const('observation'),
+    }),
+    'digital_entity': Mapping(models.DigitalEntity, {
+        'entity_id': Template('digent_{mediaID}'),
+        'entity_type': Const('DIGITAL_ENTITY'),
+        'dataset_id': Const('ningaloo'),
+        'entity_name': Field('fileName'),
+        'entity_remarks': Field('mediaComments'),
+        'digital_entity_id': Template('digent_{mediaID}'),
+        'digital_entity_type': Const('MOVING_IMAGE'),
+        'access_uri': Field('filePath'),
+        'format': Field('fileMediatype'),
+        'created': Field('timestamp'),
+    }),
+    'organism': Mapping(models.Organism, {
+        'entity_id': Template('org_{observationID}'),
+        'entity_type': Const('MATERIAL_ENTITY'),
+        'dataset_id': Const('ningaloo'),
+        'material_entity_id': Template('org_{observationID}'),
+        'material_entity_type': Const('Organism'),
+        'organism_id': Template('org_{observationID}'),
+        'organism_scope': Const('individual'),
+    }),
+    'identification': Mapping(models.Identification, {
+        'identification_id': Field('individualID'),
+        'organism_id': Template('org_{observationID}'),
+        'identification_type': Field('classificationMethod'),
+        # NOT NULL, observations of unidentified animals have no taxonID
+        'taxon_formula': Field('taxonID', default=UNIDENTIFIED),
+        'verbatim_identification': Field('scientificName'),
+        'identified_by': Field('classifiedBy'),
+        'identified_by_id': Field('classifiedBy'),
+        'date_identified': Field('classificationTimestamp'),
+    }),
+    'count_assertion': Mapping(models.Assertion, {
+        'assertion_id': Template('assert_count_{observationID}'),
+        'assertion_target_id': Template('org_{observationID}'),
+        'assertion_target_type': Const('ORGANISM'),
+        'assertion_type': Const('organismQuantity'),
+        'assertion_made_date': Field('classificationTimestamp'),
+        'assertion_value_numeric': Field('count'),
+        'assertion_unit': Const('individual'),
+    }),
+    'lifestage_assertion': Mapping(models.Assertion, {
+        'assertion_id': Template('assert_lifeStage_{observationID}'),
+        'assertion_target_id': Template('org_{observationID}'),
+        'assertion_target_type': Const('ORGANISM'),
+        'assertion_type': Const('lifeStage'),
+        'assertion_made_date': Field('classificationTimestamp'),
+        'assertion_value': Field('lifeStage'),
+    }),
+    'taxon': Mapping(models.Taxon, {
+        'taxon_id': Field('taxonID'),
+        'scientific_name': Field('scientificName'),
+    }),
+    'taxon_identification': Mapping(models.TaxonIdentification, {
+        'taxon_id': Field('taxonID'),
+        'identification_id': Field('individualID'),
+    }),
+}
+
+# mappings of every row of a resource, parents before children; the taxa are
+# distinct across observations and written apart, see camtrap_gum.TaxonStage
+RESOURCE_MAPPINGS = {
+    'deployments': ['location', 'georeference', 'deployment_event'],
+    'media': ['media_event', 'digital_entity'],
+    'media-observations': ['observation_event', 'organism', 'identification', 'count_assertion',
+                           'lifestage_assertion'],
+}
+
+# names a mapped resource goes by in a package: camtrap_dp.py writes
+# observations, earlier packages called them media-observations
+PACKAGE_RESOURCE_NAMES = {
+    'deployments': ['deployments'],
+    'media': ['media'],
+    'media-observations': ['observations', 'media-observations'],
+}
+
+
+def package_resource_name(resource_name, names):
+    """Returns the name a mapped resource has in a package.
+
+    Args:
+        resource_name (str): key of RESOURCE_MAPPINGS, e.g. 'media-observations'
+        names (iterable): resource names of the package
+
+    Returns:
+        str: name of the package resource, e.g. 'observations'
+    """
+    for name in PACKAGE_RESOURCE_NAMES[resource_name]:
+        if name in names:
+            return name
+    raise ValueError(f"The package has no {' or '.join(PACKAGE_RESOURCE_NAMES[resource_name])} resource")
+
+
+def resource_rows(resource_name, resource, **params):
+    """Builds the rows of every GUM table a Camtrap DP row feeds.
+
+    Args:
+        resource_name (str): 'deployments', 'media' or 'media-observations'
+        resource (dict): row of the resource
+        **params: Param values, e.g. location_id
+
+    Returns:
+        list: (table, values) per row, values in the order of columns(table)
+    """
+    rows = []
+    for name in RESOURCE_MAPPINGS[resource_name]:
+        rows.extend(MAPPINGS[name].rows(resource, **params))
+    return rows
+
+
+def mapped_columns(mappings):
+    columns = {}
+    for mapping in mappings.values():
+        for table, names in mapping.columns.items():
+            if columns.setdefault(table, names) != names:
+                raise ValueError(f"Mappings of {table.name} build different columns")
+    return columns
+
+
+COLUMNS = mapped_columns(MAPPINGS)
+
+
+def columns(table):
+    """Returns the column names of the value tuples the mappings build for a table.
+
+    Args:
+        table (Table): GUM table, e.g. models.Event.__table__
+
+    Returns:
+        list: column names, in the order of the values
+    """
+    return COLUMNS[table]
@@ -0,0 +1,198 @@
+import re
+import time
+
+import pandas as pd
+from sqlalchemy import CheckConstraint, DateTime, Enum, Integer, Numeric
+
+import gum_direct
+import gum_mapping
+import gum_sqlite
+
+
+# offending keys quoted per error
+EXAMPLES = 5
+
+SQL_OPERATORS = [
+    (re.compile(r"'(-?\d+(?:\.\d+)?)'"), r'\1'),
+    (re.compile(r'\bAND\b'), 'and'),
+    (re.compile(r'\bOR\b'), 'or'),
+    (re.compile(r'(?<![<>!=])=(?!=)'), '=='),
+]
+
+
+def check_expression(sqltext):
+    """Turns the SQL of a models.py CheckConstraint into a DataFrame.eval
+    expression, e.g. (decimal_latitude >= ('-90'::integer)::numeric) AND ...
+    into (decimal_latitude >= (-90)) and ...
+    """
+    expression = gum_sqlite.strip_casts(str(sqltext))
+    for pattern, replacement in SQL_OPERATORS:
+        expression = pattern.sub(replacement, expression)
+    return expression
+
+
+def examples(values):
+    values = list(values)
+    shown = ', '.join(repr(value) for value in values[:EXAMPLES])
+    return shown + (f" and {len(values) - EXAMPLES} more" if len(values) > EXAMPLES else '')
+
+
+def row_keys(table, frame, mask):
+    # the primary key of the offending rows, as the error messages quote them
+    keys = frame.loc[mask, [column.name for column in table.primary_key.columns]]
+    return [key[0] if len(key) == 1 else key for key in keys.itertuples(index=False)]
+
+
+def numeric_column(values):
+    return pd.to_numeric(values, errors='coerce')
+
+
+def check_values(table, frame):
+    """NOT NULL columns, values of the column type and enum values."""
+    errors = []
+    for column in table.columns:
+        values = frame[column.name]
+        present = values.notna()
+        if not column.nullable and column.server_default is None and not present.all():
+            errors.append(f"{table.name}.{column.name}: {(~present).sum()} rows without a value "
+                          f"({examples(row_keys(table, frame, ~present))})")
+        if isinstance(column.type, Enum):
+            invalid = present & ~values.isin(column.type.enums)
+            kind = f"one of {', '.join(column.type.enums)}"
+        elif isinstance(column.type, (Numeric, Integer)):
+            invalid = present & numeric_column(values).isna()
+            kind = 'a number'
+        elif isinstance(column.type, DateTime):
+            invalid = present & pd.to_datetime(values, format='ISO8601', errors='coerce', utc=True).isna()
+            kind = 'an ISO 8601 timestamp'
+        else:
+            continue
+        if invalid.any():
+            errors.append(f"{table.name}.{column.name}: {invalid.sum()} values are not {kind} "
+                          f"({examples(values[invalid].unique())})")
+    return errors
+
+
+def check_primary_key(table, frame):
+    names = [column.name for column in table.primary_key.columns]
+    duplicated = frame.duplicated(names, keep=False) & frame[names].notna().all(axis=1)
+    if not duplicated.any():
+        return []
+    keys = frame.loc[duplicated, names].drop_duplicates()
+    return [f"{table.name}: {duplicated.sum()} rows with {len(keys)} duplicated primary keys "
+            f"({examples(row_keys(table, frame, duplicated.index.isin(keys.index)))})"]
+
+
+def check_constraints(table, frame):
+    """Every CheckConstraint of the table over whole columns. Rows with a
+    NULL in the checked columns pass, as the database lets them."""
+    errors = []
+    for constraint in table.constraints:
+        if not isinstance(constraint, CheckConstraint):
+            continue
+        expression = check_expression(constraint.sqltext)
+        names = [column.name for column in table.columns if re.search(rf'\b{column.name}\b', expression)]
+        values = frame[names].apply(numeric_column)
+        checked = values.notna().all(axis=1)
+        if not checked.any():
+            continue
+        failed = checked & ~values.eval(expression).astype(bool)
+        if failed.any():
+            errors.append(f"{table.name}: {failed.sum()} rows fail CHECK {expression} "
+                          f"({examples(row_keys(table, frame, failed))})")
+    return errors
+
+
+def check_foreign_keys(table, frame, tables):
+    """Every foreign key of the table with set lookups of whole columns into
+    the keys of the referenced table built from the same package."""
+    errors = []
+    for constraint in table.foreign_key_constraints:
+        for element in constraint.elements:
+            values = frame[element.parent.name]
+            present = values.notna()
+            if not present.any():
+                continue
+            parent = element.column.table
+            if parent not in tables:
+                errors.append(f"{table.name}.{element.parent.name}: {present.sum()} rows reference {parent.name}, "
+                              f"which the package does not load ({examples(values[present].unique())})")
+                continue
+            keys = set(tables[parent][element.column.name].dropna())
+            missing = present & ~values.isin(keys)
+            if missing.any():
+                errors.append(f"{table.name}.{element.parent.name}: {missing.sum()} rows reference a missing "
+                              f"{parent.name}.{element.column.name} ({examples(values[missing].unique())})")
+    return errors
+
+
+def check_tables(tables):
+    """Checks the GUM rows of a package as the database would: NOT NULL and
+    column types, primary keys, CheckConstraints and foreign keys.
+
+    Args:
+        tables (dict): DataFrame per table, see gum_direct.build_tables
+
+    Returns:
+        list: one message per failed check
+    """
+    errors = []
+    for table, frame in tables.items():
+        errors.extend(check_values(table, frame))
+        errors.extend(check_primary_key(table, frame))
+        errors.extend(check_constraints(table, frame))
+        errors.extend(check_foreign_keys(table, frame, tables))
+    return errors
+
+
+def check_resources(folder='output/dp'):
+    """Checks that datapackage.json lists every resource the mapping reads
+    and that their files exist.
+
+    Args:
+        folder (str): Camtrap DP package folder
+
+    Returns:
+        list: one message per missing resource or file
+    """
+    try:
+        paths = gum_direct.resource_paths(folder)
+    except (OSError, ValueError) as error:
+        return [f"{folder}: cannot read datapackage.json ({error})"]
+    errors = []
+    for resource_name in gum_mapping.RESOURCE_MAPPINGS:
+        try:
+            name = gum_mapping.package_resource_name(resource_name, paths)
+        except ValueError as error:
+            errors.append(f"{folder}: {error}")
+            continue
+        if not paths[name].exists():
+            errors.append(f"{folder}: file {paths[name].name} of the {name} resource not found")
+    return errors
+
+
+def check_package(folder='output/dp'):
+    """Builds the GUM rows of a Camtrap DP package in memory and checks them
+    before anything is written, so bad input is rejected with every error
+    at once instead of an IntegrityError halfway through a load.
+
+    The foreign keys follow the mapping of gum_mapping: observation event ->
+    media event -> deployment event -> location, identification -> organism,
+    taxon_identification -> taxon and identification, ...
+
+    Args:
+        folder (str): Camtrap DP package folder
+
+    Returns:
+        list: one message per failed check, empty when the package loads
+    """
+    start = time.perf_counter()
+    errors = check_resources(folder)
+    if errors:
+        return errors
+    tables = gum_direct.build_tables(folder)
+    errors = check_tables(tables)
+    rows = sum(len(frame) for frame in tables.values())
+    print(f"Prechecked {rows} rows of {len(tables)} tables in {time.perf_counter() - start:.1f}s, "
+          f"{len(errors)} errors")
+    return errors
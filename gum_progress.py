@@ -0,0 +1,52 @@
+from sqlalchemy import Column, Integer, MetaData, Table, Text
+from sqlalchemy.dialects import postgresql
+
+import database
+
+
+# kept out of Base.metadata, it lives next to the tables being loaded and
+# goes away with the staging schema once swapped in
+metadata = MetaData()
+
+progress_table = Table(
+    'gum_load_progress', metadata,
+    Column('resource', Text, primary_key=True),
+    Column('row_number', Integer, nullable=False),
+)
+
+
+class LoadProgress:
+    """Last resource row of every committed batch of a batched GUM load.
+
+    The rows are saved in the transaction of the batch they close, so a
+    resumed load starts right after the last committed batch and never
+    writes a row twice.
+
+    Args:
+        resume (bool): read the offsets of an interrupted load instead of starting over
+    """
+
+    def __init__(self, resume=False):
+        with database.engine.begin() as connection:
+            if resume:
+                self.offsets = {row.resource: row.row_number for row in connection.execute(progress_table.select())}
+                print(f"Resuming after {self.offsets or 'nothing'}")
+            else:
+                progress_table.drop(connection, checkfirst=True)
+                progress_table.create(connection)
+                self.offsets = {}
+
+    def save(self, connection, positions):
+        """Records the last row written per resource.
+
+        Args:
+            connection (Connection): transaction of the batch
+            positions (dict): last row number per resource name
+        """
+        if not positions:
+            return
+        statement = postgresql.insert(progress_table)
+        statement = statement.on_conflict_do_update(index_elements=['resource'],
+                                                    set_={'row_number': statement.excluded.row_number})
+        connection.execute(statement, [{'resource': resource_name, 'row_number': row_number}
+                                      for resource_name, row_number in positions.items()])
@@ -0,0 +1,100 @@
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from sqlalchemy import text
+
+import database
+
+
+def table_dependencies(table_names):
+    """Builds the foreign key DAG of the tables to load from the metadata.
+
+    Self references are checked within the table's own transaction and the
+    ON DELETE SET NULL back pointers (location.accepted_georeference_id,
+    organism.accepted_identification_id, ...) are left NULL by the loader,
+    so neither orders tables. References to tables outside table_names are
+    to rows already in the database.
+
+    Args:
+        table_names (iterable): names of the tables to load
+
+    Returns:
+        dict: set of the parent table names per table name
+    """
+    table_names = set(table_names)
+    dependencies = {}
+    for table in database.Base.metadata.sorted_tables:
+        if table.name not in table_names:
+            continue
+        dependencies[table.name] = {
+            fk.column.table.name for fk in table.foreign_keys
+            if fk.column.table.name in table_names and fk.column.table is not table and fk.ondelete != 'SET NULL'}
+    return dependencies
+
+
+def ready_tables(dependencies, done):
+    return [name for name, parents in dependencies.items() if parents <= done]
+
+
+def load_order(table_names):
+    """Orders tables parents first along table_dependencies, so a load in
+    one transaction never leaves rows waiting for their parents. SQLite
+    checks every row inserted while such deferred violations are pending
+    against the tables referencing it, a scan per row without an index on
+    the referencing column (assertion.assertion_parent_assertion_id, ...).
+
+    Args:
+        table_names (iterable): names of the tables to load
+
+    Returns:
+        list: table names, parents before children
+    """
+    dependencies = table_dependencies(table_names)
+    order = []
+    while dependencies:
+        ready = ready_tables(dependencies, set(order))
+        if not ready:
+            raise ValueError(f"Foreign key cycle between {sorted(dependencies)}")
+        for name in ready:
+            del dependencies[name]
+        order.extend(ready)
+    return order
+
+
+def run(tasks, dependencies, workers=4):
+    """Runs the task of every table once the tables it references are loaded,
+    independent tables at the same time (taxon next to location, assertion
+    next to identification once organism is in, ...).
+
+    Each task gets its own connection and transaction, committed before the
+    tables depending on it are started.
+
+    Args:
+        tasks (dict): callable(connection) per table name
+        dependencies (dict): parent table names per table name, see table_dependencies
+        workers (int): number of tables loaded at the same time
+
+    Returns:
+        dict: return value of each task per table name
+    """
+    pending = {name: set(dependencies.get(name, ())) & set(tasks) for name in tasks}
+    done, results, running = set(), {}, {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while pending or running:
+            for name in ready_tables(pending, done):
+                del pending[name]
+                running[executor.submit(run_task, tasks[name])] = name
+            if not running:
+                raise ValueError(f"Foreign key cycle between tables {', '.join(sorted(pending))}")
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                results[name] = future.result()
+                done.add(name)
+    return results
+
+
+def run_task(task):
+    with database.engine.begin() as connection:
+        # self references (event.parent_event_id, ...) are checked at the commit
+        connection.execute(text('SET CONSTRAINTS ALL DEFERRED'))
+        return task(connection)
@@ -0,0 +1,48 @@
+import re
+
+from sqlalchemy import CheckConstraint, Enum, ForeignKeyConstraint, MetaData, Text, text
+from sqlalchemy.dialects.postgresql import UUID
+
+import database
+
+
+# (0)::numeric, '-90'::integer, 'PRESENT'::occurrence_status, ...
+PG_CAST = re.compile(r'::\w+')
+
+
+def strip_casts(sql):
+    return PG_CAST.sub('', sql)
+
+
+def sqlite_metadata():
+    """Copies the models' tables with their Postgres only definitions
+    translated for SQLite: casts dropped from check constraints and server
+    defaults, enum types turned into text checked against their values,
+    UUID into text, and foreign keys initially deferred as SQLite has no
+    SET CONSTRAINTS ALL DEFERRED.
+
+    Returns:
+        MetaData: tables to create in a SQLite database
+    """
+    metadata = MetaData()
+    for table in database.Base.metadata.sorted_tables:
+        table = table.to_metadata(metadata)
+        for column in table.columns:
+            if isinstance(column.type, Enum):
+                column.type = Enum(*column.type.enums, name=column.type.name, native_enum=False,
+                                   create_constraint=True, length=max(map(len, column.type.enums)))
+            elif isinstance(column.type, UUID):
+                column.type = Text()
+            if column.server_default is not None:
+                column.server_default.arg = text(strip_casts(str(column.server_default.arg)))
+        for constraint in table.constraints:
+            if isinstance(constraint, CheckConstraint):
+                constraint.sqltext = text(strip_casts(str(constraint.sqltext)))
+            elif isinstance(constraint, ForeignKeyConstraint):
+                constraint.initially = 'DEFERRED'
+    return metadata
+
+
+def create_schema(engine):
+    """Creates the GUM tables missing from a SQLite database."""
+    sqlite_metadata().create_all(engine, checkfirst=True)
@@ -0,0 +1,162 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from sqlalchemy import text
+from sqlalchemy.schema import AddConstraint, CreateIndex, CreateTable
+
+import database
+import gum_progress
+
+
+STAGING_SCHEMA = 'gum_staging'
+RETIRED_SCHEMA = 'gum_retired'
+
+
+def create_staging_tables():
+    """Recreates the staging schema with every GUM table, primary keys, unique
+    and check constraints included, but without secondary indexes and foreign
+    keys so the load does not maintain them row by row.
+    """
+    with database.engine.begin() as connection:
+        connection.execute(text(f'DROP SCHEMA IF EXISTS "{STAGING_SCHEMA}" CASCADE'))
+        connection.execute(text(f'CREATE SCHEMA "{STAGING_SCHEMA}"'))
+    with database.use_schema(STAGING_SCHEMA), database.engine.begin() as connection:
+        for table in database.Base.metadata.sorted_tables:
+            connection.execute(CreateTable(table, include_foreign_key_constraints=[]))
+
+
+def execute(statement):
+    with database.engine.begin() as connection:
+        connection.execute(statement)
+
+
+def execute_all(statements, workers=1):
+    """Runs every statement in its own transaction on the staging tables,
+    workers of them at the same time on separate connections."""
+    with database.use_schema(STAGING_SCHEMA), ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(execute, statements))
+
+
+def create_staging_indexes(workers=1):
+    """Builds the secondary indexes of the loaded staging tables, workers at a time."""
+    statements = [CreateIndex(index) for table in database.Base.metadata.sorted_tables for index in table.indexes]
+    execute_all(statements, workers)
+    print(f"Built {len(statements)} indexes")
+
+
+def add_staging_foreign_keys():
+    """Adds the foreign keys to the staging tables as NOT VALID, which
+    only records them: the loaded rows are checked by
+    validate_staging_foreign_keys, new ones as they are written.
+    """
+    with database.use_schema(STAGING_SCHEMA), database.engine.begin() as connection:
+        for table in database.Base.metadata.sorted_tables:
+            for constraint in table.foreign_key_constraints:
+                ddl = AddConstraint(constraint).compile(dialect=connection.dialect)
+                connection.execute(text(f'{ddl} NOT VALID'))
+
+
+def staging_foreign_keys(connection, pending=False):
+    # (table, constraint) names of the foreign keys of the staging tables, the NOT VALID ones when pending
+    return connection.execute(text(
+        'SELECT c.relname, k.conname FROM pg_constraint k JOIN pg_class c ON c.oid = k.conrelid '
+        'WHERE k.contype = \'f\' AND k.connamespace = CAST(:schema AS regnamespace)'
+        + (' AND NOT k.convalidated' if pending else '')), {'schema': STAGING_SCHEMA}).all()
+
+
+def drop_staging_indexes_and_foreign_keys():
+    """Drops the secondary indexes and foreign keys of the staging tables.
+    A load interrupted while finishing leaves some of them behind, a resumed
+    load builds them again from scratch: the models name no foreign keys, so
+    adding them twice would not fail but duplicate them.
+    """
+    with database.engine.begin() as connection:
+        foreign_keys = staging_foreign_keys(connection)
+        for table, name in foreign_keys:
+            connection.execute(text(f'ALTER TABLE "{STAGING_SCHEMA}"."{table}" DROP CONSTRAINT "{name}"'))
+        for table in database.Base.metadata.sorted_tables:
+            for index in table.indexes:
+                connection.execute(text(f'DROP INDEX IF EXISTS "{STAGING_SCHEMA}"."{index.name}"'))
+    if foreign_keys:
+        print(f"Dropped {len(foreign_keys)} foreign keys of the interrupted load")
+
+
+def validate_staging_foreign_keys(workers=1):
+    """Checks the loaded rows against the NOT VALID foreign keys, workers
+    constraints at a time. VALIDATE CONSTRAINT only takes a SHARE UPDATE
+    EXCLUSIVE lock, constraints of different tables are checked together.
+    """
+    with database.engine.connect() as connection:
+        constraints = staging_foreign_keys(connection, pending=True)
+    execute_all([text(f'ALTER TABLE "{table}" VALIDATE CONSTRAINT "{name}"') for table, name in constraints],
+                workers)
+    print(f"Validated {len(constraints)} foreign keys")
+
+
+def swap_staging():
+    """Replaces the public GUM tables by the staging ones in one transaction,
+    readers see either the previous snapshot or the new one. The previous
+    tables are dropped with their schema, objects outside the models that
+    depend on them (views, ...) go with them.
+    """
+    tables = [table.name for table in database.Base.metadata.sorted_tables]
+    with database.engine.begin() as connection:
+        connection.execute(text(f'DROP SCHEMA IF EXISTS "{RETIRED_SCHEMA}" CASCADE'))
+        connection.execute(text(f'CREATE SCHEMA "{RETIRED_SCHEMA}"'))
+        for name in tables:
+            connection.execute(text(f'ALTER TABLE public."{name}" SET SCHEMA "{RETIRED_SCHEMA}"'))
+        for name in tables:
+            connection.execute(text(f'ALTER TABLE "{STAGING_SCHEMA}"."{name}" SET SCHEMA public'))
+        connection.execute(text(f'DROP SCHEMA "{RETIRED_SCHEMA}" CASCADE'))
+        # the load progress table goes with it
+        connection.execute(text(f'DROP SCHEMA "{STAGING_SCHEMA}" CASCADE'))
+    print(f"Swapped {len(tables)} staging tables in")
+
+
+def has_progress():
+    """Tells whether an interrupted batched load left checkpoints in the staging schema."""
+    with database.engine.connect() as connection:
+        name = f'{STAGING_SCHEMA}.{gum_progress.progress_table.name}'
+        return connection.execute(text('SELECT to_regclass(:name)'), {'name': name}).scalar() is not None
+
+
+@contextmanager
+def timed(timings, phase):
+    start = time.perf_counter()
+    yield
+    timings[phase] = time.perf_counter() - start
+    print(f"{phase}: {timings[phase]:.1f}s")
+
+
+@contextmanager
+def staging_load(resume=False, workers=1):
+    """Runs the load inside the block against fresh staging tables, without
+    secondary indexes and foreign keys, then builds the indexes, adds and
+    validates the foreign keys and swaps the tables in. An error leaves the
+    public tables as they were.
+
+    Args:
+        resume (bool): keep the staging tables of an interrupted load, even
+            one interrupted after its rows were loaded
+        workers (int): indexes built and foreign keys validated at the same time
+    """
+    timings = {}
+    with timed(timings, 'tables'):
+        if resume:
+            drop_staging_indexes_and_foreign_keys()
+        else:
+            create_staging_tables()
+    with timed(timings, 'load'), database.use_schema(STAGING_SCHEMA):
+        yield
+    with timed(timings, 'indexes'):
+        create_staging_indexes(workers)
+    with timed(timings, 'foreign keys'):
+        add_staging_foreign_keys()
+    with timed(timings, 'validation'):
+        validate_staging_foreign_keys(workers)
+    with timed(timings, 'swap'):
+        swap_staging()
+    total = sum(timings.values())
+    print(f"Staging load in {total:.1f}s: " + ', '.join(
+        f"{phase} {seconds:.1f}s ({seconds / total:.0%})" for phase, seconds in timings.items()))
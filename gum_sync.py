@@ -0,0 +1,179 @@
+from datetime import datetime
+from decimal import Decimal
+from collections import defaultdict
+
+from sqlalchemy import tuple_
+
+import database
+import models
+
+
+def chunked(values, size=1000):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def comparable(column, value):
+    """Brings a value built from the package and the stored one to the same
+    python type, e.g. float and Decimal for numeric columns, float ids and
+    text for text columns.
+    """
+    if value is None:
+        return None
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        return value
+    if python_type is Decimal:
+        return Decimal(str(value)).normalize()
+    if python_type is datetime:
+        if isinstance(value, str):
+            value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        # timestamp without time zone columns keep the wall clock time
+        return value.replace(tzinfo=None)
+    if python_type in (int, str):
+        return python_type(value)
+    return value
+
+
+def key_value(column, values):
+    if column.name not in values:
+        # left to its server default, e.g. taxon_identification.taxon_order
+        return comparable(column, column.server_default.arg.text)
+    return comparable(column, values[column.name])
+
+
+def primary_key(table, values):
+    return tuple(key_value(column, values) for column in table.primary_key.columns)
+
+
+def changed_columns(table, incoming, stored):
+    return any(comparable(table.c[name], value) != comparable(table.c[name], stored.get(name))
+               for name, value in incoming.items())
+
+
+def select_in(connection, table, column, keys):
+    rows = []
+    for chunk in chunked(keys):
+        rows.extend(connection.execute(table.select().where(column.in_(chunk))).mappings())
+    return rows
+
+
+def stored_rows(connection, deployments):
+    """Reads the rows loaded for deployments, following the keys the builders
+    derive from the deploymentID, mediaID and observationID.
+
+    Args:
+        connection (Connection): open transaction
+        deployments (set): deploymentIDs
+
+    Returns:
+        dict: list of rows per table
+    """
+    rows = {}
+    for model in (models.Location, models.Georeference, models.Event):
+        rows[model.__table__] = select_in(connection, model.__table__, model.location_id, deployments)
+    event_types = {row['event_id']: row['event_type'] for row in rows[models.Event.__table__]}
+    organism_ids = {f"org_{event_id}" for event_id, event_type in event_types.items() if event_type == 'observation'}
+    digital_entity_ids = {f"digent_{event_id}" for event_id, event_type in event_types.items()
+                          if event_type == 'image capture'}
+
+    rows[models.Entity.__table__] = select_in(connection, models.Entity.__table__, models.Entity.entity_id,
+                                              organism_ids | digital_entity_ids)
+    rows[models.DigitalEntity.__table__] = select_in(connection, models.DigitalEntity.__table__,
+                                                     models.DigitalEntity.digital_entity_id, digital_entity_ids)
+    rows[models.MaterialEntity.__table__] = select_in(connection, models.MaterialEntity.__table__,
+                                                      models.MaterialEntity.material_entity_id, organism_ids)
+    rows[models.Organism.__table__] = select_in(connection, models.Organism.__table__,
+                                                models.Organism.organism_id, organism_ids)
+    rows[models.Identification.__table__] = select_in(connection, models.Identification.__table__,
+                                                      models.Identification.organism_id, organism_ids)
+    rows[models.Assertion.__table__] = select_in(connection, models.Assertion.__table__,
+                                                 models.Assertion.assertion_target_id, organism_ids)
+    identification_ids = {row['identification_id'] for row in rows[models.Identification.__table__]}
+    rows[models.TaxonIdentification.__table__] = select_in(
+        connection, models.TaxonIdentification.__table__, models.TaxonIdentification.identification_id,
+        identification_ids)
+    return rows
+
+
+def delete_keys(connection, table, keys):
+    columns = list(table.primary_key.columns)
+    for chunk in chunked(keys):
+        if len(columns) == 1:
+            condition = columns[0].in_([key[0] for key in chunk])
+        else:
+            condition = tuple_(*columns).in_(chunk)
+        connection.execute(table.delete().where(condition))
+
+
+def upsert(connection, table, rows):
+    # rows are grouped by their columns, executemany needs the same keys
+    groups = defaultdict(list)
+    for row in rows:
+        groups[tuple(row)].append(row)
+    key_names = [column.name for column in table.primary_key.columns]
+    for names, group in groups.items():
+        statement = database.insert(table)
+        updates = {name: statement.excluded[name] for name in names if name not in key_names}
+        if updates:
+            statement = statement.on_conflict_do_update(index_elements=key_names, set_=updates)
+        else:
+            statement = statement.on_conflict_do_nothing()
+        connection.execute(statement, group)
+
+
+def sync_deployments(deployments, rows, writers=None, finish=None):
+    """Applies the difference between the rows built from the package and
+    the rows stored for deployments: inserts, updates of the rows whose
+    values changed and deletes of the rows no longer built (their children
+    going with the ON DELETE CASCADE foreign keys), in one transaction.
+    Unchanged rows are not written.
+
+    Args:
+        deployments (set): deploymentIDs to synchronise, the ones removed from the package included
+        rows (iterable): table and value per column name of every row built for deployments
+        writers (dict): callable(connection) per table name for shared tables
+            written another way, e.g. the taxa of camtrap_gum.TaxonStage
+        finish (callable): callable(connection) run last in the transaction,
+            e.g. to delete the shared rows nothing refers to any more
+
+    Returns:
+        dict: number of inserted, updated and deleted rows per table name
+    """
+    incoming = defaultdict(dict)
+    for table, values in rows:
+        incoming[table][primary_key(table, values)] = values
+
+    counts = {}
+    with database.engine.begin() as connection:
+        database.defer_constraints(connection)
+        stored = {table: {primary_key(table, row): dict(row) for row in table_rows}
+                  for table, table_rows in stored_rows(connection, deployments).items()}
+
+        changes = {}
+        for table in database.Base.metadata.sorted_tables:
+            table_incoming, table_stored = incoming.get(table, {}), stored.get(table, {})
+            inserts = [values for key, values in table_incoming.items() if key not in table_stored]
+            updates = [values for key, values in table_incoming.items()
+                       if key in table_stored and changed_columns(table, values, table_stored[key])]
+            deletes = [key for key in table_stored if key not in table_incoming]
+            if inserts or updates or deletes:
+                changes[table] = inserts, updates, deletes
+                counts[table.name] = {'inserted': len(inserts), 'updated': len(updates), 'deleted': len(deletes)}
+
+        for table in reversed(database.Base.metadata.sorted_tables):
+            if table in changes:
+                delete_keys(connection, table, changes[table][2])
+        for table in database.Base.metadata.sorted_tables:
+            if table.name in (writers or {}):
+                writers[table.name](connection)
+            if table in changes:
+                upsert(connection, table, changes[table][0] + changes[table][1])
+        if finish:
+            finish(connection)
+
+    for name, count in counts.items():
+        print(f"{name}: {count['inserted']} inserted, {count['updated']} updated, {count['deleted']} deleted")
+    return counts
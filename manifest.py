@@ -0,0 +1,79 @@
+import os
+import json
+import hashlib
+from pathlib import Path
+
+
+MANIFEST_NAME = 'manifest.json'
+
+
+def sha256_file(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as fp:
+        for block in iter(lambda: fp.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def sha256_json(data_json):
+    return hashlib.sha256(json.dumps(data_json, sort_keys=True).encode()).hexdigest()
+
+
+def file_fingerprint(path, previous=None):
+    """Returns size, mtime and sha256 of a file, reusing the previous hash
+    when size and mtime are unchanged so untouched inputs are not re-read.
+
+    Args:
+        path (str): file to fingerprint
+        previous (dict): fingerprint recorded by an earlier run
+
+    Returns:
+        dict: path, size, mtime_ns and sha256
+    """
+    stat = Path(path).stat()
+    fingerprint = {'path': str(path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    if previous and all(previous.get(key) == value for key, value in fingerprint.items()):
+        return previous
+    fingerprint['sha256'] = sha256_file(path)
+    return fingerprint
+
+
+def same_content(fingerprints, previous):
+    # compares hashes only, a touched but unchanged file is still up to date
+    return set(fingerprints) == set(previous or {}) and all(
+        fingerprints[key]['sha256'] == previous[key].get('sha256') for key in fingerprints)
+
+
+def load_manifest(path):
+    if not Path(path).exists():
+        return {}
+    with open(path) as fp:
+        return json.load(fp)
+
+
+def save_manifest(path, manifest):
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as fp:
+        json.dump(manifest, fp, indent=4, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def is_up_to_date(entry, inputs, schema, output_path):
+    """Tells whether a resource recorded in a manifest entry can be reused.
+
+    Args:
+        entry (dict): manifest entry of the previous build
+        inputs (dict): current input fingerprints, keyed by input type
+        schema (dict): current schema version and hash
+        output_path (str): resource file the build would write
+
+    Returns:
+        bool: True when inputs, schema and output are all unchanged
+    """
+    if not entry or entry.get('schema') != schema or not same_content(inputs, entry.get('inputs')):
+        return False
+    if not Path(output_path).exists():
+        return False
+    output = file_fingerprint(output_path, entry.get('output'))
+    return output['sha256'] == entry.get('output', {}).get('sha256')
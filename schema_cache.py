@@ -0,0 +1,166 @@
+import os
+import json
+from pathlib import Path
+from urllib.request import urlopen
+
+
+SCHEMA_URL = "https://raw.githubusercontent.com/tdwg/camtrap-dp/{version}/{file_name}"
+
+SCHEMA_FILES = {
+    "profile": "camtrap-dp-profile.json",
+    "deployments": "deployments-table-schema.json",
+    "media": "media-table-schema.json",
+    "observations": "observations-table-schema.json",
+    "event-observations": "event-observations-table-schema.json"
+}
+
+# Read-only snapshot shipped next to the scripts, populated with
+# `camtrap_dp.py schema prefetch -v <version> -d schemas`
+BUNDLED_DIR = Path(__file__).resolve().parent / "schemas"
+DEFAULT_CACHE_DIR = Path.home() / ".cache" / "camtrap" / "schemas"
+
+# (schema name, version) -> parsed json, so a run reads each file once
+_loaded = {}
+
+
+def cache_dir():
+    return Path(os.environ.get("CAMTRAP_SCHEMA_CACHE", DEFAULT_CACHE_DIR))
+
+
+def is_offline():
+    return os.environ.get("CAMTRAP_OFFLINE", "") not in ("", "0")
+
+
+def schema_url(schema_name, version):
+    file_name = SCHEMA_FILES.get(schema_name)
+    if file_name:
+        return SCHEMA_URL.format(version=version, file_name=file_name)
+    return None
+
+
+def parse_schema_url(url):
+    # inverse of schema_url, (None, None) for urls outside the Camtrap DP repository
+    prefix = SCHEMA_URL.split("{version}")[0]
+    if not url.startswith(prefix):
+        return None, None
+    version, _, file_name = url[len(prefix):].rpartition("/")
+    schema_names = {file_name: schema_name for schema_name, file_name in SCHEMA_FILES.items()}
+    if file_name not in schema_names:
+        return None, None
+    return schema_names[file_name], version
+
+
+def schema_path(directory, schema_name, version):
+    return Path(directory) / version / SCHEMA_FILES[schema_name]
+
+
+def fetch_schema(schema_name, version):
+    url = schema_url(schema_name, version)
+    print(f"Downloading {url}")
+    with urlopen(url) as response:
+        return json.loads(response.read().decode())
+
+
+def store_schema(directory, schema_name, version, data_json):
+    path = schema_path(directory, schema_name, version)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # write then rename so concurrent runs never read a half written file
+    tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+    with open(tmp_path, 'w') as fp:
+        json.dump(data_json, fp, indent=4)
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_schema(schema_name, version):
+    """Returns a Camtrap DP schema, looking in memory, the local cache,
+    the bundled snapshot and finally the network (unless CAMTRAP_OFFLINE is set).
+
+    Args:
+        schema_name (str): one of SCHEMA_FILES keys
+        version (str): Camtrap DP release tag or branch, e.g. 1.0-rc.1
+
+    Returns:
+        dict: parsed schema json, None for an unknown schema name
+    """
+    if schema_name not in SCHEMA_FILES:
+        return None
+
+    key = (schema_name, version)
+    if key in _loaded:
+        return _loaded[key]
+
+    for directory in (cache_dir(), BUNDLED_DIR):
+        path = schema_path(directory, schema_name, version)
+        if path.exists():
+            with open(path) as fp:
+                data_json = json.load(fp)
+            break
+    else:
+        if is_offline():
+            raise FileNotFoundError(
+                f"Schema '{schema_name}' {version} is not cached in {cache_dir()} or {BUNDLED_DIR}, "
+                f"run `camtrap_dp.py schema prefetch -v {version}` on a connected machine first")
+        data_json = fetch_schema(schema_name, version)
+        store_schema(cache_dir(), schema_name, version, data_json)
+
+    _loaded[key] = data_json
+    return data_json
+
+
+def prefetch(version, schema_names=None, directory=None, refresh=False):
+    """Downloads schemas of a version into a cache directory.
+
+    Args:
+        version (str): Camtrap DP release tag or branch
+        schema_names (list): schemas to fetch, defaults to all of SCHEMA_FILES
+        directory (str): target directory, defaults to the local cache
+        refresh (bool): download again even if already cached
+
+    Returns:
+        list: paths of the cached schema files
+    """
+    directory = Path(directory) if directory else cache_dir()
+    paths = []
+    for schema_name in schema_names or SCHEMA_FILES:
+        path = schema_path(directory, schema_name, version)
+        if refresh or not path.exists():
+            path = store_schema(directory, schema_name, version, fetch_schema(schema_name, version))
+        _loaded.pop((schema_name, version), None)
+        print(f"{schema_name} {version}: {path}")
+        paths.append(path)
+    return paths
+
+
+def package_schemas(package_path):
+    """Lists the Camtrap DP schemas a datapackage.json refers to, the
+    profile included, whatever version each of them is.
+
+    Args:
+        package_path (str): datapackage.json
+
+    Returns:
+        list: sorted (schema name, version) pairs
+    """
+    with open(package_path) as fp:
+        descriptor = json.load(fp)
+    urls = [descriptor.get('profile')] + [resource.get('schema') for resource in descriptor.get('resources', [])]
+    return sorted({parse_schema_url(url) for url in urls if isinstance(url, str)} - {(None, None)})
+
+
+def prefetch_package(package_path, directory=None, refresh=False):
+    """Downloads every schema a datapackage.json refers to, so validating
+    the package works offline.
+
+    Args:
+        package_path (str): datapackage.json
+        directory (str): target directory, defaults to the local cache
+        refresh (bool): download again even if already cached
+
+    Returns:
+        list: paths of the cached schema files
+    """
+    paths = []
+    for schema_name, version in package_schemas(package_path):
+        paths.extend(prefetch(version, [schema_name], directory, refresh))
+    return paths
@@ -0,0 +1,97 @@
+import sys
+import json
+import shutil
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+import camtrap_dp
+import database
+import gum_sqlite
+import schema_cache
+
+
+VERSION = '1.0-rc.1'
+DATA = Path(__file__).resolve().parent / 'data'
+SURVEY = '2019-08-29_Test.Survey_stereo-BRUVs'
+
+# field names and types of the Camtrap DP 1.0-rc.1 table schemas the
+# converter fills, standing in for the published schemas offline
+FIELDS = {
+    'deployments': [
+        ('deploymentID', 'string'), ('locationID', 'string'), ('locationName', 'string'),
+        ('latitude', 'number'), ('longitude', 'number'), ('coordinateUncertainty', 'integer'),
+        ('deploymentStart', 'datetime'), ('deploymentEnd', 'datetime'), ('setupBy', 'string'),
+        ('cameraID', 'string'), ('cameraModel', 'string'), ('cameraDelay', 'integer'),
+        ('cameraHeight', 'number'), ('cameraTilt', 'integer'), ('cameraHeading', 'integer'),
+        ('detectionDistance', 'number'), ('timestampIssues', 'boolean'), ('baitUse', 'boolean'),
+        ('featureType', 'string'), ('habitat', 'string'), ('deploymentGroups', 'string'),
+        ('deploymentTags', 'string'), ('deploymentComments', 'string'),
+    ],
+    'media': [
+        ('mediaID', 'string'), ('deploymentID', 'string'), ('captureMethod', 'string'),
+        ('timestamp', 'datetime'), ('filePath', 'string'), ('filePublic', 'boolean'), ('fileName', 'string'),
+        ('fileMediatype', 'string'), ('exifData', 'object'), ('favorite', 'boolean'), ('mediaComments', 'string'),
+    ],
+    'observations': [
+        ('observationID', 'string'), ('deploymentID', 'string'), ('mediaID', 'string'), ('eventID', 'string'),
+        ('eventStart', 'datetime'), ('eventEnd', 'datetime'), ('observationLevel', 'string'),
+        ('observationType', 'string'), ('cameraSetupType', 'string'), ('taxonID', 'string'),
+        ('scientificName', 'string'), ('count', 'integer'), ('lifeStage', 'string'), ('sex', 'string'),
+        ('behavior', 'string'), ('individualID', 'string'), ('individualPositionRadius', 'number'),
+        ('individualPositionAngle', 'number'), ('individualSpeed', 'number'), ('bboxX', 'number'),
+        ('bboxY', 'number'), ('bboxWidth', 'number'), ('bboxHeight', 'number'),
+        ('classificationMethod', 'string'), ('classifiedBy', 'string'), ('classificationTimestamp', 'datetime'),
+        ('classificationProbability', 'number'), ('observationTags', 'string'), ('observationComments', 'string'),
+    ],
+}
+
+
+@pytest.fixture
+def schemas(tmp_path, monkeypatch):
+    cache = tmp_path / 'schemas'
+    for name, fields in FIELDS.items():
+        schema_cache.store_schema(cache, name, VERSION,
+                                  {'fields': [{'name': field, 'type': kind} for field, kind in fields]})
+    monkeypatch.setenv('CAMTRAP_SCHEMA_CACHE', str(cache))
+    monkeypatch.setenv('CAMTRAP_OFFLINE', '1')
+    monkeypatch.setattr(schema_cache, '_loaded', {})
+    return cache
+
+
+@pytest.fixture
+def convert(tmp_path, monkeypatch, schemas):
+    """Converts the test survey into a Camtrap DP package folder of tmp_path,
+    csv or Parquet, and returns its path."""
+    shutil.copytree(DATA, tmp_path / 'input')
+    # frictionless only writes csv files below the working directory
+    monkeypatch.chdir(tmp_path)
+
+    def convert_survey(output_format):
+        output_dir = Path(output_format)
+        output_dir.mkdir()
+        descriptor = {'resources': [
+            {'name': name, 'path': f"{name}.csv", 'profile': 'tabular-data-resource',
+             'schema': schema_cache.schema_url(name, VERSION)} for name in FIELDS]}
+        with open(output_dir / 'datapackage.json', 'w') as fp:
+            json.dump(descriptor, fp)
+        context = camtrap_dp.SurveyContext('input', VERSION, SURVEY, str(output_dir), output_format)
+        camtrap_dp.create_all('input', VERSION, context)
+        return str(tmp_path / output_dir)
+
+    return convert_survey
+
+
+@pytest.fixture
+def sqlite_gum(tmp_path):
+    """Points the database module at an empty SQLite GUM database."""
+    def configure(name='gum'):
+        engine = database.configure(f"sqlite:///{tmp_path / name}.sqlite")
+        gum_sqlite.create_schema(engine)
+        return engine
+
+    yield configure
+    database.configure()
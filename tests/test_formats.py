@@ -0,0 +1,59 @@
+import warnings
+from contextlib import redirect_stdout
+from io import StringIO
+
+import camtrap_gum
+import database
+import gum_direct
+import gum_precheck
+import models
+
+
+def table_contents():
+    with database.engine.connect() as connection:
+        return {table.name: sorted(map(tuple, connection.execute(table.select())), key=repr)
+                for table in database.Base.metadata.sorted_tables}
+
+
+def load_package(folder):
+    with warnings.catch_warnings(), redirect_stdout(StringIO()):
+        warnings.simplefilter('ignore')
+        camtrap_gum.load(camtrap_gum.open_package(folder))
+    return table_contents()
+
+
+def test_unidentified_points_have_no_taxon_in_either_format(convert):
+    for output_format in ('csv', 'parquet'):
+        package = camtrap_gum.open_package(convert(output_format))
+        taxa = [row['taxonID'] for row in camtrap_gum.read_rows(package, 'media-observations')]
+        assert taxa == ['37384092.0', '37390005.0', None, '37347012.0', '37384092.0']
+
+
+def test_parquet_package_loads_into_gum(convert, sqlite_gum):
+    csv_folder, parquet_folder = convert('csv'), convert('parquet')
+    with redirect_stdout(StringIO()):
+        assert gum_precheck.check_package(parquet_folder) == []
+
+    sqlite_gum('csv')
+    csv_contents = load_package(csv_folder)
+    sqlite_gum('parquet')
+    parquet_contents = load_package(parquet_folder)
+
+    assert parquet_contents == csv_contents
+    identifications = parquet_contents[models.Identification.__tablename__]
+    assert len(identifications) == 5
+    assert len(parquet_contents[models.TaxonIdentification.__tablename__]) == 4
+    assert len(parquet_contents[models.Taxon.__tablename__]) == 3
+
+
+def test_direct_tables_match_between_formats(convert, tmp_path):
+    csv_folder, parquet_folder = convert('csv'), convert('parquet')
+    tables = [entity.__table__ for entity in camtrap_gum.EXPORT_MODELS]
+    with redirect_stdout(StringIO()):
+        csv_paths = gum_direct.write_tables(tables, csv_folder, tmp_path / 'gum-csv')
+        parquet_paths = gum_direct.write_tables(tables, parquet_folder, tmp_path / 'gum-parquet')
+
+    for csv_path, parquet_path in zip(csv_paths, parquet_paths):
+        assert parquet_path.read_text() == csv_path.read_text(), csv_path.name
+    links = (tmp_path / 'gum-parquet' / f"{models.TaxonIdentification.__tablename__}.csv").read_text()
+    assert len(links.splitlines()) == 1 + 4
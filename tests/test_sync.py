@@ -0,0 +1,48 @@
+import warnings
+from contextlib import redirect_stdout
+from io import StringIO
+from pathlib import Path
+
+import pytest
+
+import camtrap_gum
+import gum_direct
+import gum_export
+
+
+def test_unchanged_package_reuses_manifest_digests(convert, monkeypatch):
+    package = camtrap_gum.open_package(convert('csv'))
+    digests, files = camtrap_gum.package_digests(package, {})
+    assert sorted(files) == ['datapackage.json', *camtrap_gum.GUM_RESOURCES]
+    gum_manifest = {'deployments': digests, 'files': files}
+
+    with monkeypatch.context() as patch:
+        patch.setattr(camtrap_gum, 'deployment_digests', pytest.fail)
+        assert camtrap_gum.package_digests(package, gum_manifest) == (digests, files)
+
+    observations = Path(camtrap_gum.get_resource(package, 'media-observations').normpath)
+    observations.write_text(observations.read_text().replace('37347012.0', '37347013.0'))
+    changed, _ = camtrap_gum.package_digests(package, gum_manifest)
+    assert camtrap_gum.changed_deployments(changed, digests) == {'1.02'}
+
+
+def test_sync_matches_a_reload(convert, sqlite_gum, tmp_path):
+    folder = convert('csv')
+    sqlite_gum()
+    package = camtrap_gum.open_package(folder)
+    tables = [entity.__table__ for entity in camtrap_gum.EXPORT_MODELS]
+    with warnings.catch_warnings(), redirect_stdout(StringIO()):
+        warnings.simplefilter('ignore')
+        camtrap_gum.load(package)
+        digests = camtrap_gum.deployment_digests(package)
+
+        # the only observation of a taxon moves to another one
+        observations = Path(camtrap_gum.get_resource(package, 'media-observations').normpath)
+        observations.write_text(observations.read_text().replace('37347012.0', '37390005.0'))
+        package = camtrap_gum.open_package(folder)
+        camtrap_gum.sync(package, camtrap_gum.changed_deployments(camtrap_gum.deployment_digests(package), digests))
+
+        synced = gum_export.export_tables(tables, tmp_path / 'gum')
+        reloaded = gum_direct.write_tables(tables, folder, tmp_path / 'direct')
+    for synced_path, reloaded_path in zip(synced, reloaded):
+        assert synced_path.read_text() == reloaded_path.read_text(), synced_path.name
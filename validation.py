@@ -0,0 +1,457 @@
+import json
+import time
+import operator
+from pathlib import Path
+from itertools import zip_longest
+from urllib.request import urlopen
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from frictionless import Metadata, Package, Report, Resource, errors, settings
+
+import schema_cache
+
+
+# frictionless stops a resource at the same number of errors
+LIMIT_ERRORS = settings.DEFAULT_LIMIT_ERRORS
+QUICK_SAMPLE = 10000
+
+# report order inside a row, as frictionless appends them
+CELL, UNIQUE, PRIMARY_KEY, FOREIGN_KEY = range(4)
+
+
+def resolve_schema(schema, base_path):
+    """Returns the schema of a package resource as a dict.
+
+    Args:
+        schema (dict|str): inline schema, url or path relative to the package
+        base_path (Path): folder of datapackage.json
+
+    Returns:
+        dict: table schema
+    """
+    if isinstance(schema, dict):
+        return schema
+    schema_name, version = schema_cache.parse_schema_url(schema)
+    if schema_name:
+        return schema_cache.load_schema(schema_name, version)
+    if schema.startswith(('http://', 'https://')):
+        with urlopen(schema) as response:
+            return json.loads(response.read().decode())
+    with open(base_path / schema) as fp:
+        return json.load(fp)
+
+
+def package_resources(package_path, descriptor=None):
+    """Returns the file resources of a package with their schema resolved.
+
+    Args:
+        package_path (str): datapackage.json
+        descriptor (dict): parsed datapackage.json, read from package_path when None
+
+    Returns:
+        dict: path, place (path relative to the package) and schema per resource name
+    """
+    package_path = Path(package_path)
+    if descriptor is None:
+        with open(package_path) as fp:
+            descriptor = json.load(fp)
+    resources = {}
+    for resource in descriptor.get('resources', []):
+        if isinstance(resource.get('path'), str) and resource.get('schema'):
+            resources[resource['name']] = {
+                'path': str(package_path.parent / resource['path']),
+                'place': resource['path'],
+                'schema': resolve_schema(resource['schema'], package_path.parent)
+            }
+    return resources
+
+
+def check_descriptor(descriptor):
+    """Validates datapackage.json against the data package and Camtrap DP profiles,
+    the Camtrap DP profile being read from the schema cache.
+
+    Args:
+        descriptor (dict): parsed datapackage.json
+
+    Returns:
+        list: frictionless metadata errors
+    """
+    profile = descriptor.get('profile')
+    schema_name, version = schema_cache.parse_schema_url(profile) if isinstance(profile, str) else (None, None)
+    if schema_name != 'profile':
+        return list(Package.metadata_validate(descriptor))
+    descriptor = {key: value for key, value in descriptor.items() if key != 'profile'}
+    descriptor_errors = list(Package.metadata_validate(descriptor))
+    descriptor_errors += list(Metadata.metadata_validate(
+        descriptor, profile=schema_cache.load_schema('profile', version), error_class=errors.PackageError))
+    return descriptor_errors
+
+
+def sample_rows(path, size, seed=0):
+    # sorted positions of the data rows kept by the quick mode
+    if str(path).endswith('.parquet'):
+        import pyarrow.parquet as pq
+        count = pq.read_metadata(path).num_rows
+    else:
+        with open(path, 'rb') as fp:
+            count = sum(1 for _ in fp) - 1
+    if count <= size:
+        return None
+    return np.sort(np.random.default_rng(seed).choice(count, size, replace=False))
+
+
+def read_table(path, rows=None, columns=None):
+    """Reads a resource, csv cells are kept as strings.
+
+    Args:
+        path (str): csv or parquet file
+        rows (array): positions of the data rows to read, all when None
+        columns (list): columns to read, all when None
+
+    Returns:
+        DataFrame: table indexed by row number, the header being row 1
+    """
+    if str(path).endswith('.parquet'):
+        import pyarrow.parquet as pq
+        df = pq.read_table(path, columns=columns).to_pandas()
+        if rows is not None:
+            df = df.iloc[rows]
+    else:
+        skiprows = None
+        if rows is not None:
+            kept = set(rows.tolist())
+            skiprows = lambda line: line > 0 and line - 1 not in kept
+        df = pd.read_csv(path, dtype=str, keep_default_na=False, usecols=columns, skiprows=skiprows)
+        if rows is not None:
+            df.index = rows
+    df.index = df.index + 2
+    return df
+
+
+def parse_pattern(values, pattern):
+    return values.where(values.astype(str).str.fullmatch(pattern))
+
+
+def parse_integer(values, field):
+    return pd.to_numeric(parse_pattern(values, r'[+-]?\d+'), errors='coerce')
+
+
+def parse_number(values, field):
+    return pd.to_numeric(values, errors='coerce')
+
+
+def parse_year(values, field):
+    return pd.to_numeric(parse_pattern(values, r'\d{4}'), errors='coerce')
+
+
+def parse_boolean(values, field):
+    mapping = {value: True for value in field.get('trueValues', settings.DEFAULT_TRUE_VALUES)}
+    mapping.update({value: False for value in field.get('falseValues', settings.DEFAULT_FALSE_VALUES)})
+    mapping.update({True: True, False: False})
+    return values.map(mapping)
+
+
+def parse_datetime(values, field):
+    field_format = field.get('format', 'default')
+    if field_format == 'default':
+        text = values.astype(str)
+        # same shape check as the frictionless reader before isoparse
+        values = values.where((text.str.len() >= 19) & (text.str[16] == ':'))
+        return pd.to_datetime(values, format='ISO8601', errors='coerce', utc=True)
+    if field_format == 'any':
+        return pd.to_datetime(values, errors='coerce', utc=True)
+    return pd.to_datetime(values, format=field_format, errors='coerce', utc=True)
+
+
+def parse_date(values, field):
+    field_format = field.get('format', 'default')
+    field_format = '%Y-%m-%d' if field_format == 'default' else field_format
+    return pd.to_datetime(values, format=None if field_format == 'any' else field_format, errors='coerce')
+
+
+def parse_time(values, field):
+    field_format = field.get('format', 'default')
+    field_format = '%H:%M:%S' if field_format == 'default' else field_format
+    return pd.to_datetime(values, format=None if field_format == 'any' else field_format, errors='coerce')
+
+
+PARSERS = {
+    'integer': parse_integer,
+    'number': parse_number,
+    'year': parse_year,
+    'boolean': parse_boolean,
+    'datetime': parse_datetime,
+    'date': parse_date,
+    'time': parse_time
+}
+
+
+def parse_column(values, field):
+    """Casts a column to the field type.
+
+    Args:
+        values (Series): cells, NaN for missing values
+        field (dict): table schema field
+
+    Returns:
+        tuple: parsed Series and the mask of cells failing the type
+    """
+    field_type = field.get('type', 'any')
+    if field_type == 'datetime' and pd.api.types.is_datetime64_any_dtype(values):
+        # typed parquet column, compared in utc like the parsed strings
+        values = values.dt.tz_localize('UTC') if values.dt.tz is None else values.dt.tz_convert('UTC')
+    if values.dtype != object or field_type not in PARSERS:
+        return values, pd.Series(False, index=values.index)
+    parsed = PARSERS[field_type](values, field)
+    return parsed, values.notna() & parsed.isna()
+
+
+def parse_constraint(value, field):
+    return parse_column(pd.Series([value], dtype=object), field)[0].iloc[0]
+
+
+def constraint_masks(values, parsed, field):
+    # yields (constraint name, mask of cells breaking it), only type-valid cells are checked
+    constraints = field.get('constraints', {})
+    present = parsed.notna()
+    if constraints.get('required'):
+        yield 'required', values.isna()
+    for name, compare in (('minimum', operator.ge), ('maximum', operator.le)):
+        if name in constraints:
+            yield name, present & ~compare(parsed, parse_constraint(constraints[name], field))
+    for name, compare in (('minLength', operator.ge), ('maxLength', operator.le)):
+        if name in constraints:
+            yield name, present & ~compare(values.astype(str).str.len(), constraints[name])
+    if 'pattern' in constraints:
+        yield 'pattern', present & ~values.astype(str).str.fullmatch(constraints['pattern'])
+    if 'enum' in constraints:
+        enum = [parse_constraint(value, field) for value in constraints['enum']]
+        yield 'enum', present & ~parsed.isin(enum)
+
+
+def previous_duplicates(frame):
+    # row number of the previous row holding the same key, NaN when the key is new
+    rows = pd.Series(frame.index, index=frame.index)
+    return rows.groupby([frame[column] for column in frame.columns], dropna=False).shift()
+
+
+def as_list(value):
+    return value if isinstance(value, list) else [value]
+
+
+def to_cells(raw, row_number):
+    return ['' if value is None or value is pd.NA or value is np.nan else str(value)
+            for value in raw.loc[row_number]]
+
+
+class ResourceChecker:
+    """Runs the frictionless table checks of one resource column by column.
+
+    Args:
+        name (str): resource name
+        resources (dict): path and schema of every package resource, for foreign keys
+        rows (array): positions of the sampled rows, all rows when None
+    """
+
+    def __init__(self, name, resources, rows=None):
+        self.name = name
+        self.resources = resources
+        self.path = resources[name]['path']
+        self.schema = resources[name]['schema']
+        self.rows = rows
+        self.found = []
+
+    def add(self, mask, phase, field_number, factory):
+        # keeps the first LIMIT_ERRORS rows of the mask, the report is cut after sorting anyway
+        row_numbers = mask.index[np.flatnonzero(mask.to_numpy(dtype=bool))][:LIMIT_ERRORS]
+        for order, row_number in enumerate(row_numbers):
+            self.found.append((row_number, phase, field_number, order, factory))
+
+    def parse_table(self, df, schema):
+        missing_values = schema.get('missingValues', settings.DEFAULT_MISSING_VALUES)
+        values = df.copy()
+        # typed parquet columns have no missing value markers
+        for name in df.columns[df.dtypes == object]:
+            values[name] = df[name].mask(df[name].isin(missing_values))
+        parsed = {}
+        for field in schema['fields']:
+            if field['name'] in df.columns:
+                parsed[field['name']] = parse_column(values[field['name']], field)
+        return values, parsed
+
+    def check_labels(self, labels, fields):
+        label_errors = []
+        for field_number, (label, field) in enumerate(zip_longest(labels, fields), start=1):
+            options = dict(note='', labels=labels, row_numbers=[1], field_number=field_number)
+            if field is None:
+                label_errors.append(errors.ExtraLabelError(label=label, field_name='', **options))
+            elif label is None:
+                label_errors.append(errors.MissingLabelError(label='', field_name=field['name'], **options))
+            elif label != field['name']:
+                label_errors.append(errors.IncorrectLabelError(label=label, field_name=field['name'], **options))
+        return label_errors
+
+    def check_cells(self, raw, values, parsed, fields):
+        for field_number, field in enumerate(fields, start=1):
+            name = field['name']
+            if name not in parsed:
+                continue
+            column, type_mask = parsed[name]
+            type_note = f'type is "{field.get("type", "any")}/{field.get("format", "default")}"'
+            self.add(type_mask, CELL, field_number,
+                     self.cell_error(errors.TypeError, raw, name, field_number, type_note))
+            for constraint, mask in constraint_masks(values[name], column, field):
+                note = f'constraint "{constraint}" is "{field["constraints"][constraint]}"'
+                self.add(mask, CELL, field_number,
+                         self.cell_error(errors.ConstraintError, raw, name, field_number, note))
+
+            if field.get('constraints', {}).get('unique'):
+                previous = previous_duplicates(column[column.notna()].to_frame())
+                self.add(previous.notna().reindex(column.index, fill_value=False), UNIQUE, field_number,
+                         self.cell_error(errors.UniqueError, raw, name, field_number, previous=previous))
+
+    def check_primary_key(self, raw, parsed):
+        primary_key = as_list(self.schema.get('primaryKey', []))
+        if not primary_key or any(name not in parsed for name in primary_key):
+            return
+        keys = pd.DataFrame({name: parsed[name][0] for name in primary_key})
+        all_none = keys.isna().all(axis=1)
+        note = 'cells composing the primary keys are all "None"'
+        self.add(all_none, PRIMARY_KEY, 0, lambda row_number: errors.PrimaryKeyError(
+            note=note, cells=to_cells(raw, row_number), row_number=int(row_number)))
+        previous = previous_duplicates(keys[~all_none])
+        self.add(previous.notna().reindex(keys.index, fill_value=False), PRIMARY_KEY, 0,
+                 lambda row_number: errors.PrimaryKeyError(
+                     note=f"the same as in the row at position {int(previous[row_number])}",
+                     cells=to_cells(raw, row_number), row_number=int(row_number)))
+
+    def reference_keys(self, reference_name, reference_fields, parsed):
+        if reference_name in ('', self.name) and self.rows is None:
+            return pd.DataFrame({name: parsed[name][0] for name in reference_fields})
+        # the other table (or the whole table in quick mode) only needs its key columns
+        reference = self.resources[reference_name]
+        df = read_table(reference['path'], columns=reference_fields)
+        fields = {field['name']: field for field in reference['schema']['fields']}
+        _, reference_parsed = self.parse_table(df, {**reference['schema'], 'fields': [
+            fields[name] for name in reference_fields]})
+        return pd.DataFrame({name: reference_parsed[name][0] for name in reference_fields})
+
+    def check_foreign_keys(self, raw, parsed):
+        for foreign_key in self.schema.get('foreignKeys', []):
+            field_names = as_list(foreign_key['fields'])
+            reference_name = foreign_key['reference'].get('resource', '')
+            reference_fields = as_list(foreign_key['reference']['fields'])
+            if any(name not in parsed for name in field_names):
+                continue
+            if reference_name not in ('', self.name) and reference_name not in self.resources:
+                continue
+            keys = pd.DataFrame({name: parsed[name][0] for name in field_names})
+            reference = self.reference_keys(reference_name, reference_fields, parsed).dropna(how='all')
+            if len(field_names) == 1:
+                missing = ~keys[field_names[0]].isin(reference[reference_fields[0]])
+            else:
+                missing = pd.Series(~pd.MultiIndex.from_frame(keys).isin(pd.MultiIndex.from_frame(reference)),
+                                    index=keys.index)
+            source_name = reference_name or self.name
+            self.add(missing & ~keys.isna().all(axis=1), FOREIGN_KEY, 0,
+                     self.foreign_key_error(raw, keys, field_names, source_name, reference_fields))
+
+    def cell_error(self, error_class, raw, field_name, field_number, note=None, previous=None):
+        def factory(row_number):
+            cell = raw.at[row_number, field_name]
+            return error_class(
+                note=note if previous is None else f"the same as in the row at position {int(previous[row_number])}",
+                cells=to_cells(raw, row_number),
+                row_number=int(row_number),
+                cell='' if cell is None else str(cell),
+                field_name=field_name,
+                field_number=field_number,
+            )
+        return factory
+
+    def foreign_key_error(self, raw, keys, field_names, reference_name, reference_fields):
+        def factory(row_number):
+            cells = [keys.at[row_number, name] for name in field_names]
+            note = 'for "%s": values "%s" not found in the lookup table "%s" as "%s"' % (
+                ", ".join(field_names), ", ".join(str(cell) for cell in cells),
+                reference_name, ", ".join(reference_fields))
+            return errors.ForeignKeyError(
+                note=note,
+                cells=to_cells(raw, row_number),
+                row_number=int(row_number),
+                field_names=field_names,
+                field_cells=[str(cell) for cell in cells],
+                reference_name=reference_name,
+                reference_field_names=reference_fields,
+            )
+        return factory
+
+    def run(self):
+        """Returns a frictionless Report of the resource."""
+        start = time.perf_counter()
+        raw = read_table(self.path, self.rows)
+        fields = self.schema['fields']
+        labels = list(raw.columns)
+        values, parsed = self.parse_table(raw, self.schema)
+
+        self.check_cells(raw, values, parsed, fields)
+        self.check_primary_key(raw, parsed)
+        self.check_foreign_keys(raw, parsed)
+
+        self.found.sort(key=lambda found: found[:4])
+        report_errors = self.check_labels(labels, fields)
+        report_errors += [factory(row_number) for row_number, _, _, _, factory in self.found]
+        warnings = []
+        if len(report_errors) > LIMIT_ERRORS:
+            report_errors = report_errors[:LIMIT_ERRORS]
+            warnings.append(f"reached error limit: {LIMIT_ERRORS}")
+        if self.rows is not None:
+            warnings.append(f"quick mode: checked {len(raw)} sampled rows")
+
+        resource = Resource(path=self.resources[self.name]['place'], name=self.name)
+        resource.stats.fields = len(labels)
+        resource.stats.rows = len(raw)
+        return Report.from_validation_task(resource, time=round(time.perf_counter() - start, 3), labels=labels,
+                                           errors=report_errors, warnings=warnings)
+
+
+def validate_resource(name, resources, sample=None, seed=0):
+    # runs in a worker process, frictionless errors lose their properties when pickled
+    rows = sample_rows(resources[name]['path'], sample, seed) if sample else None
+    return ResourceChecker(name, resources, rows).run().to_descriptor()
+
+
+def validate_package(package_path, workers=None, quick=False, sample=QUICK_SAMPLE, seed=0):
+    """Validates the tables of a data package with one worker process per resource.
+
+    Checks labels, types, constraints, unique fields, primary keys and foreign
+    keys on whole columns and reports them as frictionless `validate` does.
+
+    Args:
+        package_path (str): datapackage.json
+        workers (int): worker processes, defaults to the cpu count
+        quick (bool): only check a random sample of rows of every resource,
+            foreign keys are still looked up in the whole referenced table
+        sample (int): rows per resource in quick mode
+        seed (int): seed of the quick mode sample
+
+    Returns:
+        Report: frictionless validation report
+    """
+    start = time.perf_counter()
+    package_path = Path(package_path)
+    with open(package_path) as fp:
+        descriptor = json.load(fp)
+
+    descriptor_errors = check_descriptor(descriptor)
+    if descriptor_errors:
+        return Report.from_validation(time=round(time.perf_counter() - start, 3), errors=descriptor_errors)
+
+    resources = package_resources(package_path, descriptor)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(validate_resource, name, resources, sample if quick else None, seed)
+                   for name in resources]
+        reports = [Report.from_descriptor(future.result()) for future in futures]
+    return Report.from_validation_reports(time=round(time.perf_counter() - start, 3), reports=reports)